@@ -1,18 +1,48 @@
 import os
-from fastapi import FastAPI, Form, HTTPException, Response, Body
-from fastapi.responses import JSONResponse
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, HTTPException, Response, Body, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from requirement_analysis.main import extract_requirements
+from requirement_analysis.streaming import stream_requirements
+from requirement_analysis.extract_from_doc import shutdown_pool
 from architecture_and_tech_stack.main import get_tech_stack_recommendation, generate_architecture_diagram
-from time_and_effort_estimation.main import generate_effort_excel
-from business_analyst.main import get_user_persona, categorize_features
+from time_and_effort_estimation.main import build_effort_excel
+from time_and_effort_estimation.estimate_index import get_estimate_index
+from business_analyst.main import analyze_requirements
 from wireframe_generator.main import selenium_pipeline
+from pipeline.main import run_presales_pipeline
+from core.llm_client import init_clients, close_clients
+from core.downloads import close_client as close_download_client
+from core.jobs import JobManager, create_job_store
+from core.metrics import HTTP_REQUEST_DURATION, render_metrics
+from core.tracing import span, get_trace
+from core.single_flight import SingleFlight, request_key
+from core.rate_limit import current_priority, priority, BATCH
+from core.llm_cache import bypass_cache, is_bypassed
+from pydantic import ValidationError
 from typing import List, Dict,Optional
-import json
+import base64
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the pooled async LLM clients once per worker
+    await init_clients()
+    await job_manager.start()
+    # Index the historical estimates once instead of per request
+    get_estimate_index()
+    yield
+    await job_manager.stop()
+    await close_clients()
+    await close_download_client()
+    shutdown_pool()
+
+
+# orjson serializes the large requirement/persona payloads several times faster than json
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Enable CORS 
 app.add_middleware(
@@ -23,6 +53,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Open a root span per request and record endpoint latency."""
+    started = time.perf_counter()
+    status = 500
+    trace_id = request.headers.get("X-Trace-Id")
+    # "Cache-Control: no-cache" forces fresh LLM responses for this request
+    no_cache = "no-cache" in request.headers.get("Cache-Control", "")
+    with span("http.request", trace_id=trace_id, method=request.method, path=request.url.path) as root:
+        try:
+            if no_cache:
+                with bypass_cache():
+                    response = await call_next(request)
+            else:
+                response = await call_next(request)
+            status = response.status_code
+        finally:
+            route = request.scope.get("route")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                endpoint=route.path if route else "unmatched",
+                status=status,
+            )
+    response.headers["X-Trace-Id"] = root["trace_id"]
+    return response
+
 # Define request body models
 class ModuleFeature(BaseModel):
     name: str
@@ -60,6 +117,7 @@ class ExtractRequest(BaseModel):
      url: str
      requirement_tech_stack: str = None  # Optional
      requirement_platforms: str = None
+     previous_url: str = None  # Earlier version of the same RFP, for incremental re-extraction
 
 class SubFeature(BaseModel):
     name: str
@@ -74,22 +132,137 @@ class Module(BaseModel):
     module: str
     features: List[ModuleFeature]
 
- 
+class PipelineRequest(BaseModel):
+    requirement_text: str
+    url: str
+    requirement_tech_stack: str = None  # Optional
+    requirement_platforms: str = None
+    isMobileApp: bool = False
+    stages: Optional[List[str]] = None  # Defaults to every stage
+
+class ArchitectureRequest(BaseModel):
+    requirements: Requirements
+    tech_stack: TechStack
+
+class WireframeRequest(BaseModel):
+    featureBreakdown: List[Module]
+    isMobileApp: bool
+
+
+# Task runners, keyed by the endpoint they mirror. Shared by the endpoints and background jobs.
+async def _extract_job(req: ExtractRequest):
+    return await extract_requirements(
+        req.requirement_text, req.url, req.requirement_tech_stack, req.requirement_platforms, req.previous_url
+    )
+
+async def _tech_stack_job(req: Requirements):
+    return await get_tech_stack_recommendation(req.dict(), req.requirement_tech_stack)
+
+async def _architecture_diagram_job(req: ArchitectureRequest):
+    return await generate_architecture_diagram(req.requirements.dict(), req.tech_stack.dict())
+
+async def _estimate_job(req: Requirements):
+    excel_data = await build_effort_excel(req)
+    if excel_data is None:
+        raise ValueError("No valid effort estimation data available.")
+    return excel_data
+
+async def _user_persona_job(req: RequirementRequest):
+    return await analyze_requirements(req.requirement_json)
+
+async def _wireframe_job(req: WireframeRequest):
+    return await selenium_pipeline(req.featureBreakdown, req.isMobileApp)
+
+async def _pipeline_job(req: PipelineRequest):
+    return await run_presales_pipeline(
+        req.requirement_text, req.url, req.requirement_tech_stack, req.requirement_platforms,
+        req.isMobileApp, req.stages,
+    )
+
+JOB_KINDS = {
+    "extract": (ExtractRequest, _extract_job),
+    "tech-stack-recommendation": (Requirements, _tech_stack_job),
+    "architecture-diagram": (ArchitectureRequest, _architecture_diagram_job),
+    "estimate": (Requirements, _estimate_job),
+    "generate-user-persona": (RequirementRequest, _user_persona_job),
+    "generate-wireframe": (WireframeRequest, _wireframe_job),
+    "pipeline": (PipelineRequest, _pipeline_job),
+}
+
+# Identical concurrent requests of these kinds share one upstream computation
+COALESCED_KINDS = {"extract", "tech-stack-recommendation", "architecture-diagram", "estimate", "generate-user-persona"}
+
+single_flight = SingleFlight()
+
+async def run_task(kind, req):
+    """Run the task for an endpoint, joining an identical in-flight request if there is one."""
+    _, runner = JOB_KINDS[kind]
+    if kind not in COALESCED_KINDS:
+        return await runner(req)
+    # Requests that bypass the LLM cache must not join one that may be served from it
+    namespace = f"{kind}-no-cache" if is_bypassed() else kind
+    # Nor an interactive request one running at background priority
+    if current_priority() == BATCH:
+        namespace += "-batch"
+    return await single_flight.do(request_key(namespace, req.dict()), lambda: runner(req))
+
+def _job_handler(kind):
+    async def handler(req):
+        # Background jobs yield LLM capacity to interactive requests
+        with priority(BATCH):
+            result = await run_task(kind, req)
+        if isinstance(result, bytes):
+            # The estimate workbook is binary, jobs carry it as base64
+            return {"filename": "effort_estimation.xlsx", "content_base64": base64.b64encode(result).decode("ascii")}
+        return result
+    return handler
+
+job_manager = JobManager(create_job_store(), {kind: _job_handler(kind) for kind in JOB_KINDS})
+
 
 
 @app.get("/")
 async def get_response():
     return "hello world!!"
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for endpoints, LLM calls, parsing and pipeline stages."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces/{trace_id}")
+async def get_trace_spans(trace_id: str):
+    """Returns the recorded spans of a recent request, as identified by its X-Trace-Id header."""
+    spans = get_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found.")
+    return spans
+
 @app.post("/extract")
-def extract(req: ExtractRequest):
+async def extract(req: ExtractRequest):
      try:
-         result = extract_requirements(req.requirement_text, req.url, req.requirement_tech_stack, req.requirement_platforms)
-         return {"message": "Extraction successful", "data": result}
+         result = await run_task("extract", req)
+         # Returned as a Response so FastAPI skips its jsonable_encoder pass
+         return ORJSONResponse({"message": "Extraction successful", "data": result})
      except Exception as e:
          print(e)
          raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/extract/stream")
+async def extract_stream(req: ExtractRequest):
+    """
+    Streams the extraction as Server-Sent Events. Each requirement and each
+    feature_breakdown module is sent as soon as the model has generated it,
+    followed by a "done" event with the full result.
+    """
+    if req.previous_url:
+        raise HTTPException(status_code=400, detail="previous_url is not supported for streaming; use /extract or /jobs/extract.")
+    return StreamingResponse(
+        stream_requirements(req.requirement_text, req.url, req.requirement_tech_stack, req.requirement_platforms),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/tech-stack-recommendation")
 async def tech_stack_recommendation(req: Requirements):
     """
@@ -100,8 +273,8 @@ async def tech_stack_recommendation(req: Requirements):
         raise HTTPException(status_code=400, detail="Requirements are missing in the request body.")
 
     try:
-        response = get_tech_stack_recommendation(req.dict(), req.requirement_tech_stack)
-        return response
+        response = await run_task("tech-stack-recommendation", req)
+        return ORJSONResponse(response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -118,8 +291,8 @@ async def create_architecture_diagram(requirements: Requirements, tech_stack: Te
         raise HTTPException(status_code=400, detail="Tech stack is missing in the request body.")
 
     try:
-        response = generate_architecture_diagram(requirements.dict(), tech_stack.dict())
-        return response
+        response = await run_task("architecture-diagram", ArchitectureRequest(requirements=requirements, tech_stack=tech_stack))
+        return ORJSONResponse(response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
@@ -127,10 +300,8 @@ async def create_architecture_diagram(requirements: Requirements, tech_stack: Te
 async def estimate_effort(req: Requirements):
     try:
         output_excel = "effort_estimation.xlsx"
-        generate_effort_excel(req, output_excel)
-        
-        with open(output_excel, "rb") as file:
-            excel_data = file.read()
+        # Built in memory per request, nothing is written to the working directory
+        excel_data = await run_task("estimate", req)
         
         return Response(
             content=excel_data,
@@ -146,13 +317,10 @@ async def generate_user_persona(request: RequirementRequest):
     FastAPI endpoint to process requirements and generate user personas.
     """
     try:
-        requirement_str = json.dumps(request.requirement_json)
-        user_persona = get_user_persona(requirement_str)
-        categorized_features = categorize_features(requirement_str)
-        response_json =  {"user_persona": json.loads(user_persona), "categorized_features": json.loads(categorized_features)}
+        response_json = await run_task("generate-user-persona", request)
         # print(response_json)
 
-        return response_json
+        return ORJSONResponse(response_json)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -167,7 +335,7 @@ async def generate_wireframe_endpoint(featureBreakdown: List[Module] = Body(...,
     try:
         # # Convert to dict if generate_wireframe expects JSON-like dict
         # feature_breakdown_dict = [module.dict() for module in featureBreakdown]
-        wireframe_data = selenium_pipeline(featureBreakdown, isMobileApp)
+        wireframe_data = await selenium_pipeline(featureBreakdown, isMobileApp)
 
         return {
             "message": "Wireframe generation successful",
@@ -176,6 +344,49 @@ async def generate_wireframe_endpoint(featureBreakdown: List[Module] = Body(...,
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+@app.post("/pipeline")
+async def presales_pipeline(req: PipelineRequest):
+    """
+    Runs extraction and every downstream stage in one call. Stages that only
+    need the extraction run concurrently; the response includes per-stage timings.
+    """
+    try:
+        result = await run_presales_pipeline(
+            req.requirement_text, req.url, req.requirement_tech_stack, req.requirement_platforms,
+            req.isMobileApp, req.stages,
+        )
+        return ORJSONResponse(result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/jobs/{kind}", status_code=202)
+async def submit_job(kind: str, payload: Dict = Body(...)):
+    """
+    Queues a long-running task and returns its job id. The body is the same
+    as the body of the endpoint named by `kind`.
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind: {kind}")
+
+    request_model, _ = JOB_KINDS[kind]
+    try:
+        req = request_model.parse_obj(payload)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+    job = await job_manager.submit(kind, req)
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Returns the status of a job, and its result once it has finished.
+    """
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return ORJSONResponse(job)
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,26 +1,39 @@
-import os
-import json
-from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from dotenv import load_dotenv
-# from together import Together
-from openai import OpenAI
-import networkx as nx
-import json
-import re
-
-# Load API key from .env file
-load_dotenv()
-api_key = os.getenv("TOGETHER_API_KEY")
-
-# Initialize Together client
-# client = Together(api_key=api_key)
-client = OpenAI(
-    base_url="https://models.inference.ai.azure.com",
-    api_key=os.environ["GITHUB_TOKEN"],
-)
-
-
-def get_tech_stack_recommendation(requirements_json,requirement_tech_stack):
+from core.llm_client import hedged_completion
+from core.json_repair import JSONRepairError, is_json, parse_json
+from core.metrics import PARSE_FAILURES
+from core.prompts import compact_json, scaled_output_budget
+
+_COMPONENTS = {"type": "array", "default": [], "items": {"type": "object", "required": ["name"]}}
+
+# Layers the model leaves out (e.g. no third-party APIs) come back as empty lists
+TECH_STACK_SCHEMA = {
+    "type": "object",
+    "required": ["frontend", "backend"],
+    "properties": {layer: _COMPONENTS for layer in ("frontend", "backend", "database", "API_integrations", "others")},
+}
+
+ARCHITECTURE_SCHEMA = {
+    "type": "object",
+    "required": ["nodes"],
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {"type": "object", "required": ["id"], "properties": {"attributes": {"type": "object", "default": {}}}},
+        },
+        "edges": {
+            "type": "array",
+            "default": [],
+            "items": {
+                "type": "object",
+                "required": ["source", "target"],
+                "properties": {"attributes": {"type": "object", "default": {}}},
+            },
+        },
+    },
+}
+
+
+async def get_tech_stack_recommendation(requirements_json,requirement_tech_stack):
     prompt = f"""
         You are an AI expert in software architecture and technology stacks. Given the following project requirements in JSON format, recommend a suitable tech stack in JSON format.
 
@@ -28,10 +41,10 @@ def get_tech_stack_recommendation(requirements_json,requirement_tech_stack):
         STRICTLY adhere to the provided Tech Stack Preferences. If a technology preference is mentioned, prioritize and include it. Only suggest alternatives if no preference is explicitly stated for a particular layer.
 
         Requirements:
-        {json.dumps(requirements_json, indent=2)}
+        {compact_json(requirements_json)}
 
         Tech Stack Preference: 
-        {json.dumps(requirement_tech_stack, indent=2)}
+        {compact_json(requirement_tech_stack)}
 
         Provide output in the following format:
         {{
@@ -71,7 +84,9 @@ def get_tech_stack_recommendation(requirements_json,requirement_tech_stack):
         """
 
     print(requirement_tech_stack)
-    response = client.chat.completions.create(
+    response = await hedged_completion(
+        "github",
+        name="tech_stack",
         messages=[
             {
                 "role": "user",
@@ -79,56 +94,47 @@ def get_tech_stack_recommendation(requirements_json,requirement_tech_stack):
             }
         ],
         model="gpt-4o",
-        max_tokens=1500,
+        # Grows with the number of integrations and components implied by the requirements
+        max_tokens=scaled_output_budget("gpt-4o", prompt, ratio=0.5, minimum=1500),
         temperature=0.77,
         top_p=0.7,
         frequency_penalty=0,
         presence_penalty=0,
-        stop=["</s>"]
+        stop=["</s>"],
+        cache_check=lambda text: is_json(text, TECH_STACK_SCHEMA),
     )
     
     raw_output = response.choices[0].message.content  # Extract text from response
-    
-    # Define response schema
-    response_schemas = [
-        ResponseSchema(name="frontend", description="Recommended frontend technologies"),
-        ResponseSchema(name="backend", description="Recommended backend technologies"),
-        ResponseSchema(name="database", description="Recommended database technologies"),
-        ResponseSchema(name="API_integrations", description="List of third-party APIs, if applicable"),
-        ResponseSchema(name="others", description="Other relevant tools or technologies")
-    ]
-
-    parser = StructuredOutputParser.from_response_schemas(response_schemas)
+
     try:
-        parsed_output = parser.parse(raw_output)
-    except Exception as e:
+        parsed_output = parse_json(raw_output, TECH_STACK_SCHEMA)
+    except JSONRepairError as e:
         print(f"Error: {e}. Returning raw output.")
+        PARSE_FAILURES.inc(parser="get_tech_stack_recommendation")
         return raw_output
     
-    return json.dumps(parsed_output, indent=4)
+    return parsed_output
 
 def clean_json_response(response_text):
     """
-    Cleans AI response by removing markdown formatting (json) and extra text.
+    Parses the AI response into the architecture graph, repairing code fences,
+    surrounding text and malformed or truncated JSON.
     """
     try:
-        # Remove Markdown code block indicators (json ... )
-        if "json" in response_text:
-            response_text = response_text.split("json")[1].split("```")[0].strip()
-        return json.loads(response_text)  # Parse clean JSON
-    except (json.JSONDecodeError, IndexError) as e:
-        # logging.error(f"Error parsing AI JSON response: {e}")
+        return parse_json(response_text, ARCHITECTURE_SCHEMA)
+    except JSONRepairError as e:
+        PARSE_FAILURES.inc(parser="clean_json_response")
         return {"error": str(e), "raw_output": response_text}
 
-def generate_architecture_diagram(requirements_json, tech_stack_json):
+async def generate_architecture_diagram(requirements_json, tech_stack_json):
     prompt = f"""
         You are an expert software architect. Given the following project requirements and recommended tech stack, generate a structured JSON representation of a system architecture graph.
 
         Requirements:
-        {json.dumps(requirements_json, indent=2)}
+        {compact_json(requirements_json)}
 
         Tech Stack:
-        {json.dumps(tech_stack_json, indent=2)}
+        {compact_json(tech_stack_json)}
 
         The JSON output must strictly follow this format:
         {{
@@ -146,7 +152,9 @@ def generate_architecture_diagram(requirements_json, tech_stack_json):
         Return only valid JSON without any additional text.
     """
 
-    response = client.chat.completions.create(
+    response = await hedged_completion(
+        "github",
+        name="architecture",
         messages=[
             {
                 "role": "user",
@@ -154,19 +162,23 @@ def generate_architecture_diagram(requirements_json, tech_stack_json):
             }
         ],
         model="gpt-4o",
-        max_tokens=2500,
+        # One node per component and one edge per interaction, so larger systems need more room
+        max_tokens=scaled_output_budget("gpt-4o", prompt, ratio=1.0, minimum=2500),
         temperature=0.77,
         top_p=0.7,
         frequency_penalty=0,
         presence_penalty=0,
-        stop=["</s>"]
+        stop=["</s>"],
+        cache_check=lambda text: is_json(text, ARCHITECTURE_SCHEMA),
     )
 
     raw_output = response.choices[0].message.content.strip()
     graph_data = clean_json_response(raw_output)  # Clean & parse JSON
 
     if "error" in graph_data:
-        return json.dumps(graph_data, indent=4)  # Return error info
+        return graph_data  # Return error info
+
+    import networkx as nx
 
     # Convert JSON structure to NetworkX graph
     G = nx.DiGraph()
@@ -0,0 +1,397 @@
+"""
+End-to-end benchmark of the API endpoints against the local stand-in LLM server.
+
+Usage:
+    python benchmarks/endpoints.py [--requests 50] [--concurrency 8]
+        [--latency lognormal:800,0.5] [--stages extract estimate ...]
+        [--identical] [--cache] [--output results.json]
+
+Starts llm_stub_server and the app (uvicorn) as separate processes, serves
+temp.pdf and a DOCX copy of it locally for /extract, then drives each stage
+at the given concurrency. Reports p50/p95/p99 latency, throughput, errors,
+and the app process's CPU time and peak RSS per stage (read from /proc, so
+those two are Linux only). Results are written as JSON for tracking
+regressions.
+
+Request bodies differ per request by default so coalescing and caches do not
+hide the work; --identical sends the same body every time and --cache leaves
+the LLM response cache, near-duplicate index, extracted text cache and
+download store enabled. Provider rate limits are lifted so the stand-in
+latency is what is measured.
+/generate-wireframe drives a real browser against usegalileo.ai and is only
+run when listed in --stages.
+"""
+import os
+import sys
+import time
+import json
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_STAGES = [
+    "extract", "tech-stack-recommendation", "architecture-diagram", "estimate", "generate-user-persona",
+]
+ALL_STAGES = DEFAULT_STAGES + ["generate-wireframe"]
+
+FEATURE_BREAKDOWN = [
+    {
+        "module": "User Management",
+        "features": [
+            {
+                "name": "User Authentication",
+                "description": "Lets users sign up, log in and recover their accounts.",
+                "subfeatures": [
+                    {"name": "Password Reset", "description": "Reset a forgotten password via email."},
+                    {"name": "Session Management", "description": "Handles session expiry and token refresh."},
+                ],
+            }
+        ],
+    },
+    {
+        "module": "Catalogue",
+        "features": [
+            {
+                "name": "Product Search",
+                "description": "Full-text search with filters over the catalogue.",
+                "subfeatures": [
+                    {"name": "Filters", "description": "Filter results by category and price."},
+                    {"name": "Sorting", "description": "Sort results by relevance, price or rating."},
+                ],
+            }
+        ],
+    },
+]
+
+TECH_STACK = {
+    "frontend": [{"name": "React", "description": "Component-based UI"}],
+    "backend": [{"name": "FastAPI", "description": "Async Python API framework"}],
+    "database": [{"name": "PostgreSQL", "description": "Relational store"}],
+    "API_integrations": [{"name": "Stripe", "description": "Payments"}],
+    "others": [{"name": "Docker", "description": "Deployments"}],
+}
+
+
+def _requirements(tag):
+    return {
+        "functionalRequirement": ["Users can register and log in", "Users can search products"],
+        "nonFunctionalRequirement": ["Pages load within 2 seconds"],
+        "featureBreakdown": FEATURE_BREAKDOWN,
+        "requirement_tech_stack": f"No preference{tag}",
+        "requirement_platforms": "Web",
+    }
+
+
+def build_request(stage, index, docs_url, identical):
+    """Return (path, body) for the index-th request of a stage."""
+    tag = "" if identical else f" (benchmark request {index})"
+    if stage == "extract":
+        document = "temp.pdf" if index % 2 == 0 or identical else "temp.docx"
+        return "/extract", {"requirement_text": f"Extract the requirements{tag}", "url": f"{docs_url}/{document}"}
+    if stage == "tech-stack-recommendation":
+        return "/tech-stack-recommendation", _requirements(tag)
+    if stage == "architecture-diagram":
+        return "/architecture-diagram", {"requirements": _requirements(tag), "tech_stack": TECH_STACK}
+    if stage == "estimate":
+        return "/estimate", _requirements(tag)
+    if stage == "generate-user-persona":
+        return "/generate-user-persona", {"requirement_json": dict(_requirements(tag), request=index)}
+    if stage == "generate-wireframe":
+        modules = [dict(module, module=module["module"] + tag) for module in FEATURE_BREAKDOWN]
+        return "/generate-wireframe", {"featureBreakdown": modules, "isMobileApp": False}
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class ProcessMonitor:
+    """CPU time and sampled peak RSS of a process, read from /proc."""
+
+    def __init__(self, pid, interval=0.02):
+        self.pid = pid
+        self.interval = interval
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self._peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def cpu_seconds(self):
+        if not self.available:
+            return None
+        with open(f"/proc/{self.pid}/stat") as file:
+            # Fields after the parenthesised command name; utime and stime are the 12th and 13th
+            fields = file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def rss_bytes(self):
+        with open(f"/proc/{self.pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    def start(self):
+        self._peak_rss = 0
+        self._stop.clear()
+        if self.available:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling and return the peak RSS in bytes seen since `start`."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self._peak_rss if self.available else None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self._peak_rss = max(self._peak_rss, self.rss_bytes())
+            time.sleep(self.interval)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before listening on {port}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for port {port}")
+
+
+def prepare_documents(directory):
+    """Copy temp.pdf into `directory` and write a DOCX with the same text next to it."""
+    import fitz
+    from docx import Document
+
+    with open(os.path.join(REPO_ROOT, "temp.pdf"), "rb") as source:
+        pdf_bytes = source.read()
+    with open(os.path.join(directory, "temp.pdf"), "wb") as target:
+        target.write(pdf_bytes)
+
+    document = Document()
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+        for page in pdf:
+            document.add_paragraph(page.get_text())
+    document.save(os.path.join(directory, "temp.docx"))
+
+
+def serve_documents(directory, port):
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def app_environment(stub_url, args, workdir):
+    env = dict(os.environ)
+    env.update({
+        "LLM_TRANSPORT": "live",
+        "LLM_BASE_URL_GITHUB": stub_url,
+        "LLM_BASE_URL_TOGETHER": f"{stub_url}/v1",
+        "GITHUB_TOKEN": env.get("GITHUB_TOKEN") or "benchmark",
+        "TOGETHER_API_KEY": env.get("TOGETHER_API_KEY") or "benchmark",
+        "LLM_RPM_GITHUB": "1000000",
+        "LLM_RPM_TOGETHER": "1000000",
+        "LLM_CONCURRENCY_GITHUB": "10000",
+        "LLM_CONCURRENCY_TOGETHER": "10000",
+        # Backup requests would be counted as extra upstream load
+        "LLM_HEDGING": "off",
+        "LLM_CACHE_PATH": os.path.join(workdir, "llm_cache.db"),
+        "NEAR_DUPLICATE_INDEX_PATH": os.path.join(workdir, "documents.db"),
+        "EXTRACTED_TEXT_CACHE_PATH": os.path.join(workdir, "extracted_text.db"),
+        "DOWNLOAD_STORE_PATH": os.path.join(workdir, "downloads.db"),
+        "PYTHONPATH": REPO_ROOT,
+    })
+    if not args.cache:
+        env["LLM_CACHE"] = "off"
+        env["NEAR_DUPLICATE_INDEX"] = "off"
+        env["EXTRACTED_TEXT_CACHE"] = "off"
+        env["DOWNLOAD_STORE"] = "off"
+    return env
+
+
+async def run_stage(client, stage, args, docs_url, monitor):
+    import httpx
+
+    for index in range(args.warmup):
+        path, body = build_request(stage, -1 - index, docs_url, args.identical)
+        await client.post(path, json=body)
+
+    latencies = []
+    statuses = {}
+    counter = iter(range(args.requests))
+
+    async def worker():
+        for index in counter:
+            path, body = build_request(stage, index, docs_url, args.identical)
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    cpu_before = monitor.cpu_seconds()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - started
+    peak_rss = monitor.stop()
+    cpu_after = monitor.cpu_seconds()
+
+    errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1),
+        },
+        "cpu_seconds": round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1) if peak_rss is not None else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args):
+    import httpx
+
+    workdir = tempfile.mkdtemp(prefix="presales-bench-")
+    prepare_documents(workdir)
+    docs_server = serve_documents(workdir, _free_port())
+    docs_url = f"http://127.0.0.1:{docs_server.server_address[1]}"
+
+    stub_port, app_port = _free_port(), _free_port()
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "llm_stub_server", "main.py"),
+         "--port", str(stub_port), "--latency", args.latency],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=app_environment(f"http://127.0.0.1:{stub_port}", args, workdir),
+        stdout=subprocess.DEVNULL if not args.verbose else None,
+        stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    try:
+        _wait_for_port(stub_port, stub)
+        _wait_for_port(app_port, app)
+        monitor = ProcessMonitor(app.pid)
+        stages = {}
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{app_port}", timeout=args.timeout, limits=limits
+        ) as client:
+            for stage in args.stages:
+                print(f"Running {stage} ({args.requests} requests, concurrency {args.concurrency})...")
+                stages[stage] = await run_stage(client, stage, args, docs_url, monitor)
+    finally:
+        for process in (app, stub):
+            process.terminate()
+            process.wait(timeout=10)
+        docs_server.shutdown()
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latency": args.latency,
+            "warmup": args.warmup,
+            "identical": args.identical,
+            "cache": args.cache,
+        },
+        "stages": stages,
+    }
+
+
+def print_table(results):
+    header = f"{'stage':<28}{'ok':>5}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>8}{'cpu s':>8}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for stage, result in results["stages"].items():
+        latency = result["latency_ms"]
+        print(
+            f"{stage:<28}{result['requests'] - result['errors']:>5}{result['errors']:>5}"
+            f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}{result['throughput_rps']:>8}"
+            f"{str(result['cpu_seconds']):>8}{str(result['peak_rss_mb']):>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="Measured requests per stage")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests per stage")
+    parser.add_argument("--latency", default="lognormal:800,0.5", help="Stand-in LLM latency distribution")
+    parser.add_argument("--stages", nargs="+", default=DEFAULT_STAGES, choices=ALL_STAGES)
+    parser.add_argument("--identical", action="store_true", help="Send the same body for every request")
+    parser.add_argument("--cache", action="store_true", help="Keep the LLM cache and near-duplicate index on")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Results file (default benchmarks/results/endpoints-<time>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's output")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    print_table(results)
+
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"endpoints-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
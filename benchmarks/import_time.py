@@ -0,0 +1,77 @@
+"""
+Measure how long `import app` takes in a fresh interpreter.
+
+Usage:
+    python benchmarks/import_time.py [--runs 10] [--module app]
+
+Each run starts a new Python process, so module caches from earlier runs do
+not hide import cost. The script also fails if any heavy dependency that
+should only load on first use was imported, or if the import touched the
+network.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that must not be imported until a request needs them
+LAZY_MODULES = [
+    "selenium", "webdriver_manager", "langchain", "networkx", "pandas",
+    "pymupdf", "fitz", "docx", "openai", "together", "requests", "aiohttp",
+]
+
+_PROBE = """
+import json, socket, sys, time
+
+def _blocked(*args, **kwargs):
+    raise RuntimeError("network access during import")
+
+socket.socket.connect = _blocked
+socket.create_connection = _blocked
+
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+loaded = [name for name in {lazy!r} if name in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded}}))
+"""
+
+
+def measure(module, runs):
+    """Import `module` in `runs` fresh interpreters and return the timings."""
+    probe = _PROBE.format(module=module, lazy=LAZY_MODULES)
+    # Startup must work without credentials
+    env = {k: v for k, v in os.environ.items() if k not in ("GITHUB_TOKEN", "TOGETHER_API_KEY")}
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    timings, loaded = [], set()
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", probe], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        loaded.update(result["loaded"])
+    return timings, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--module", default="app")
+    args = parser.parse_args()
+
+    timings, loaded = measure(args.module, args.runs)
+    print(f"import {args.module}: median {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms over {args.runs} runs")
+    if loaded:
+        print(f"❌ Heavy modules loaded at import time: {', '.join(loaded)}")
+        sys.exit(1)
+    print("✅ No heavy dependencies loaded at import time")
+
+
+if __name__ == "__main__":
+    main()
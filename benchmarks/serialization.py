@@ -0,0 +1,97 @@
+"""
+Compare the old and new serialization paths for large endpoint payloads.
+
+Usage:
+    python benchmarks/serialization.py [--modules 100] [--repeat 20]
+
+"old" reproduces the previous flow: the model output is parsed, re-dumped
+with indent=4, wrapped in another JSON document and encoded by FastAPI's
+jsonable_encoder + JSONResponse. "new" parses once and renders the native
+structure with ORJSONResponse.
+"""
+import json
+import orjson
+import argparse
+import statistics
+import time
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+
+def build_extraction(modules, features=15, subfeatures=5):
+    """Synthetic extraction output shaped like extract_requirements_llm's result."""
+    return {
+        "functional_requirements": [f"Functional requirement {i} with some descriptive text" for i in range(modules * 2)],
+        "non_functional_requirements": [f"Non-functional requirement {i}" for i in range(modules)],
+        "feature_breakdown": [
+            {
+                "module": f"Module {m}",
+                "features": [
+                    {
+                        "name": f"Feature {m}.{f}",
+                        "description": "Brief explanation of what this feature does and why it is necessary.",
+                        "subfeatures": [
+                            {"name": f"Subfeature {m}.{f}.{s}", "description": "Detailed description of what this subfeature does."}
+                            for s in range(subfeatures)
+                        ],
+                    }
+                    for f in range(features)
+                ],
+            }
+            for m in range(modules)
+        ],
+    }
+
+
+def old_extract_path(raw_output):
+    parsed = json.loads(raw_output)
+    data = json.dumps(parsed, indent=4)
+    return JSONResponse(jsonable_encoder({"message": "Extraction successful", "data": data})).body
+
+
+def new_extract_path(raw_output):
+    parsed = json.loads(raw_output)
+    return ORJSONResponse({"message": "Extraction successful", "data": parsed}).body
+
+
+def old_persona_path(requirement_json, raw_output):
+    prompt_input = json.dumps(requirement_json)
+    persona = json.dumps(json.loads(raw_output), indent=4)
+    return len(prompt_input), JSONResponse(jsonable_encoder({"user_persona": json.loads(persona)})).body
+
+
+def new_persona_path(requirement_json, raw_output):
+    prompt_input = orjson.dumps(requirement_json).decode()
+    return len(prompt_input), ORJSONResponse({"user_persona": json.loads(raw_output)}).body
+
+
+def timed(func, repeat, *args):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    extraction = build_extraction(args.modules)
+    raw_output = json.dumps(extraction)
+    print(f"Payload: {args.modules} modules, {len(raw_output) / 1024:.0f} KiB of model output")
+
+    for name, old, new, call_args in [
+        ("extract", old_extract_path, new_extract_path, (raw_output,)),
+        ("user persona", old_persona_path, new_persona_path, (extraction, raw_output)),
+    ]:
+        old_ms = timed(old, args.repeat, *call_args)
+        new_ms = timed(new, args.repeat, *call_args)
+        print(f"{name:>13}: old {old_ms:8.2f} ms   new {new_ms:8.2f} ms   speedup {old_ms / new_ms:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,233 @@
 import os
-import json
-from langchain.output_parsers import StructuredOutputParser, ResponseSchema
-from dotenv import load_dotenv
-from together import Together
-import networkx as nx
-import re
+import asyncio
+from core.llm_client import hedged_completion
+from core.json_repair import JSONRepairError, is_json, parse_json
+from core.metrics import PARSE_FAILURES
+from core.prompts import OUTPUT_HEADROOM, compact_json, count_tokens, model_limits, scaled_output_budget, split_to_fit
 
-# Load API key from .env file
-load_dotenv()
-api_key = os.getenv("TOGETHER_API_KEY")
+MODEL = "mistralai/Mistral-7B-Instruct-v0.3"
+# Persona output runs to about this many tokens per token of requirements
+PERSONA_OUTPUT_RATIO = 1.5
+# Requirements larger than this are split by module into concurrent persona requests,
+# so each response fits the model's output limit (less room for the prompt template)
+PERSONA_BATCH_TOKENS = int(model_limits(MODEL)["max_output"] / (PERSONA_OUTPUT_RATIO * OUTPUT_HEADROOM)) - 500
+# Categorization lists every feature once, about as long as its description
+CATEGORY_OUTPUT_RATIO = 1.0
+# Features are categorized in concurrent batches of about this many tokens; smaller
+# batches finish sooner but see less of the project at once
+CATEGORY_BATCH_TOKENS = min(
+    int(os.getenv("CATEGORY_BATCH_TOKENS", "2000")),
+    int(model_limits(MODEL)["max_output"] / (CATEGORY_OUTPUT_RATIO * OUTPUT_HEADROOM)) - 500,
+)
+# Categorization batches carry at most this much of the other requirement fields as context
+CATEGORY_CONTEXT_TOKENS = CATEGORY_BATCH_TOKENS // 4
+# However large the other fields are, features get at least this share of each batch
+MIN_FEATURE_SHARE = 0.5
+CATEGORIES = ("must_have", "nice_to_have", "future_enhancements")
 
-# Initialize Together client
-client = Together(api_key=api_key)
+PERSONA_SCHEMA = {
+    "type": "object",
+    "required": ["personas"],
+    "properties": {
+        "personas": {
+            "type": "array",
+            "items": {"type": "object", "required": ["type"], "properties": {"workflows": {"type": "array", "default": []}}},
+        },
+    },
+}
 
-def get_user_persona(requirement_json: str):
+CATEGORIES_SCHEMA = {
+    "type": "object",
+    "required": ["feature_categories"],
+    "properties": {
+        "feature_categories": {
+            "type": "object",
+            "properties": {
+                category: {"type": "array", "default": [], "items": {"type": "object", "required": ["feature"]}}
+                for category in CATEGORIES
+            },
+        },
+    },
+}
+
+def _load_requirements(requirement_json):
+    if isinstance(requirement_json, str):
+        try:
+            return parse_json(requirement_json)
+        except JSONRepairError:
+            return requirement_json
+    return requirement_json
+
+
+def _bounded_context(rest, max_tokens):
+    """
+    The fields other than the feature breakdown, cut down to about
+    `max_tokens`: lists keep their leading items, other values are kept
+    whole while they fit.
+    """
+    if count_tokens(compact_json(rest)) <= max_tokens:
+        return rest
+    bounded, size = {}, 0
+    for name, value in rest.items():
+        if isinstance(value, list):
+            kept = []
+            for item in value:
+                item_size = count_tokens(compact_json(item))
+                if size + item_size > max_tokens:
+                    break
+                kept.append(item)
+                size += item_size
+            bounded[name] = kept
+        else:
+            value_size = count_tokens(compact_json(value))
+            if size + value_size <= max_tokens:
+                bounded[name] = value
+                size += value_size
+    return bounded
+
+
+def split_requirements(requirement_json, max_tokens, context_tokens=None):
+    """
+    Split requirements into copies that each keep the other fields but only
+    part of the feature breakdown, staying within `max_tokens`. Features are
+    packed in order and regrouped under their modules, so a module is only
+    divided when it doesn't fit on its own. Small requirements, or ones
+    without a feature breakdown, come back as a single batch.
+
+    With `context_tokens`, the other fields repeated in every batch are cut
+    down to about that size. Either way features get at least
+    MIN_FEATURE_SHARE of each batch, so large requirement lists can't shrink
+    batches to a feature or two.
+    """
+    data = _load_requirements(requirement_json)
+    if not isinstance(data, dict):
+        return [data]
+    key = next((name for name in ("featureBreakdown", "feature_breakdown") if isinstance(data.get(name), list)), None)
+    if key is None or count_tokens(compact_json(data)) <= max_tokens:
+        return [data]
+    rest = {name: value for name, value in data.items() if name != key}
+    if context_tokens is not None:
+        rest = _bounded_context(rest, context_tokens)
+    budget = max(int(max_tokens * MIN_FEATURE_SHARE), max_tokens - count_tokens(compact_json(rest)))
+
+    # (module index, feature), or (module index, None) for a module without a feature list
+    items = []
+    for index, module in enumerate(data[key]):
+        features = module.get("features") if isinstance(module, dict) else None
+        if isinstance(features, list) and features:
+            items.extend((index, feature) for feature in features)
+        else:
+            items.append((index, None))
+
+    def measure(item):
+        index, feature = item
+        return count_tokens(compact_json(data[key][index] if feature is None else feature))
+
+    batches = []
+    for batch in split_to_fit(items, budget, measure=measure):
+        modules, last_index = [], None
+        for index, feature in batch:
+            if feature is None:
+                modules.append(data[key][index])
+            elif index == last_index:
+                modules[-1]["features"].append(feature)
+            else:
+                modules.append(dict(data[key][index], features=[feature]))
+            last_index = None if feature is None else index
+        batches.append(dict(rest, **{key: modules}))
+    return batches
+
+
+def _name_key(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def merge_personas(results):
+    """
+    Combine persona results from several batches in order. Personas of the
+    same type are joined, keeping the first description and adding workflows
+    not seen under that persona yet.
+    """
+    personas, by_type = [], {}
+    for result in results:
+        for persona in result.get("personas", []):
+            if not isinstance(persona, dict):
+                continue
+            key = _name_key(persona.get("type"))
+            existing = by_type.get(key)
+            if existing is None:
+                existing = by_type[key] = dict(persona, workflows=[])
+                personas.append(existing)
+            seen = {_name_key(workflow.get("name")) for workflow in existing["workflows"] if isinstance(workflow, dict)}
+            for workflow in persona.get("workflows", []):
+                name = _name_key(workflow.get("name")) if isinstance(workflow, dict) else None
+                if name is None or name not in seen:
+                    existing["workflows"].append(workflow)
+                    seen.add(name)
+    return {"personas": personas}
+
+
+def merge_categories(results):
+    """
+    Combine feature categorizations from several batches. Each category keeps
+    the batches' order, and a feature listed more than once is kept only in
+    its first, highest-priority place.
+    """
+    merged, seen = {category: [] for category in CATEGORIES}, set()
+    for category in CATEGORIES:
+        for result in results:
+            for item in result["feature_categories"].get(category, []):
+                key = _name_key(item.get("feature"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged[category].append(item)
+    return {"feature_categories": merged}
+
+
+async def analyze_requirements(requirement_json):
+    """
+    Generate user personas and the feature categorization concurrently; neither
+    depends on the other.
+
+    Returns:
+        dict: {"user_persona": ..., "categorized_features": ...}
+    """
+    user_persona, categorized_features = await asyncio.gather(
+        get_user_persona(requirement_json), categorize_features(requirement_json)
+    )
+    return {"user_persona": user_persona, "categorized_features": categorized_features}
+
+
+async def get_user_persona(requirement_json):
     """
     Analyze requirements and generate detailed user personas with their workflows.
+    Large feature breakdowns are split by module into concurrent requests and
+    the personas merged.
     
     Args:
-        requirement_json (str): JSON string containing requirements analysis
+        requirement_json (dict | str): Requirements analysis, as a dict or JSON string
         
     Returns:
-        str: JSON string containing user personas and their workflows
+        dict: User personas and their workflows
     """
+    batches = split_requirements(requirement_json, PERSONA_BATCH_TOKENS)
+    if len(batches) == 1:
+        return await _persona_batch(batches[0])
+
+    print(f"Splitting persona generation into {len(batches)} requests")
+    results = await asyncio.gather(*(_persona_batch(batch) for batch in batches))
+    parsed = [result for result in results if "error" not in result]
+    if not parsed:
+        return results[0]
+    if len(parsed) < len(results):
+        print(f"⚠️ {len(results) - len(parsed)} of {len(results)} persona batches could not be parsed and were skipped")
+    return merge_personas(parsed)
+
+
+async def _persona_batch(requirement_json):
+    """Generate personas for one batch of requirements."""
+    requirement_json = compact_json(requirement_json)
     
     prompt = f"""
     Analyze the following software requirements and create detailed user personas with their workflows.
@@ -59,39 +264,59 @@ def get_user_persona(requirement_json: str):
     Provide the output in valid JSON format only, without any additional text.
     """
 
-    response = client.chat.completions.create(
-        model="mistralai/Mistral-7B-Instruct-v0.3",
+    response = await hedged_completion(
+        "together",
+        name="persona",
+        model=MODEL,
         messages=[{"role": "user", "content": prompt}],
-        max_tokens=3000,
+        # Personas and workflows grow with the number of features they reference
+        max_tokens=scaled_output_budget(MODEL, prompt, ratio=PERSONA_OUTPUT_RATIO, minimum=3000),
         temperature=0.7,
         top_p=0.7,
         top_k=50,
         repetition_penalty=1,
         stop=["</s>"],
+        cache_check=lambda text: is_json(text, PERSONA_SCHEMA),
     )
 
     try:
-        # Extract the JSON string from the response
+        # Extract (and if needed repair) the JSON from the response
         raw_output = response.choices[0].message.content
-        # Parse and re-serialize to ensure valid JSON
-        parsed_json = json.loads(raw_output)
-        return json.dumps(parsed_json, indent=4)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"Failed to parse LLM response: {str(e)}"})
+        return parse_json(raw_output, PERSONA_SCHEMA)
+    except JSONRepairError as e:
+        PARSE_FAILURES.inc(parser="get_user_persona")
+        return {"error": f"Failed to parse LLM response: {str(e)}"}
     
 
 
-def categorize_features(requirement_json: str):
-    
+async def categorize_features(requirement_json):
     """
     Categorize features into must-have, nice-to-have, and future enhancements based on requirements.
+    Features are packed into batches of about CATEGORY_BATCH_TOKENS, categorized
+    concurrently and merged. Each batch carries only a bounded part of the
+    other requirements (CATEGORY_CONTEXT_TOKENS) for context.
     
     Args:
-        requirement_json (str): JSON string containing requirements analysis
+        requirement_json (dict | str): Requirements analysis, as a dict or JSON string
         
     Returns:
-        str: JSON string containing categorized features with priorities
+        dict: Categorized features with priorities
     """
+    batches = split_requirements(requirement_json, CATEGORY_BATCH_TOKENS, CATEGORY_CONTEXT_TOKENS)
+    if len(batches) > 1:
+        print(f"Splitting feature categorization into {len(batches)} requests")
+    results = await asyncio.gather(*(_categorize_batch(batch) for batch in batches))
+    parsed = [result for result in results if "error" not in result]
+    if not parsed:
+        return results[0]
+    if len(parsed) < len(results):
+        print(f"⚠️ {len(results) - len(parsed)} of {len(results)} categorization batches could not be parsed and were skipped")
+    return merge_categories(parsed)
+
+
+async def _categorize_batch(requirement_json):
+    """Categorize the features of one batch of requirements."""
+    requirement_json = compact_json(requirement_json)
     
     prompt = f"""
     Analyze the following software requirements and categorize features into priority levels.
@@ -131,23 +356,27 @@ def categorize_features(requirement_json: str):
     Provide the output in valid JSON format only, without any additional text.
     """
 
-    response = client.chat.completions.create(
-        model="mistralai/Mistral-7B-Instruct-v0.3",
+    response = await hedged_completion(
+        "together",
+        name="categorize",
+        model=MODEL,
         messages=[{"role": "user", "content": prompt}],
-        max_tokens=2000,
+        # Every feature is listed once in the categorization
+        max_tokens=scaled_output_budget(MODEL, prompt, ratio=CATEGORY_OUTPUT_RATIO, minimum=2000),
         temperature=0.7,
         top_p=0.7,
         top_k=50,
         repetition_penalty=1,
         stop=["</s>"],
+        cache_check=lambda text: is_json(text, CATEGORIES_SCHEMA),
     )
 
     try:
         raw_output = response.choices[0].message.content
-        parsed_json = json.loads(raw_output)
-        return json.dumps(parsed_json, indent=4)
-    except json.JSONDecodeError as e:
-        return json.dumps({"error": f"Failed to parse LLM response: {str(e)}"})
+        return parse_json(raw_output, CATEGORIES_SCHEMA)
+    except JSONRepairError as e:
+        PARSE_FAILURES.inc(parser="categorize_features")
+        return {"error": f"Failed to parse LLM response: {str(e)}"}
 
 
 if __name__ == "__main__":
@@ -155,5 +384,5 @@ if __name__ == "__main__":
     sample_requirement_json = r'''{"message":"Requirements already extracted","functionalRequirement":["AI-Powered Proficiency Assessment","Adaptive Lesson Planning","Conversational AI for Real-Life Dialogues","Spaced Repetition & Revision Scheduling"],"nonFunctionalRequirement":["Successful deployment of the MVP with all core AI-driven functionalities","AI adjusts lesson difficulty dynamically based on real-time user performance","Conversational AI engages naturally and provides contextual corrections","Speech recognition achieves at least 85% phonetic accuracy","Spaced repetition module improves recall and learning efficiency","Scalability and efficiency of AI-powered adaptive learning engine","Security compliance and data protection measures","Accuracy of AI-generated language explanations vs. human instructors"],"featureBreakdown":[{"component":"AI-Powered Proficiency Assessment","description":"AI evaluates the user's proficiency level via a diagnostic test at onboarding and ongoing performance analysis from lesson interactions using speech, text, and grammar evaluation. The frontend displays the UI for test-taking and proficiency, the backend stores user proficiency levels and learning history, and the AI Component uses NLP + ML models for proficiency detection and scoring."},{"component":"Adaptive Lesson Planning","description":"Provides personalized lesson plans targeting weak areas. AI generates tailored daily lessons based on user's availability and learning goals. Dynamically adjusts difficulty level based on real-time performance. The frontend displays adaptive lessons in an interactive format, the backend manages lesson data and user progression, and the AI Component uses reinforcement learning for content difficulty optimization."},{"component":"Conversational AI for Real-Life Dialogues","description":"AI simulates real-world conversations for practical learning. The AI can understand and correct grammar mistakes, adapt responses based on the user's proficiency, engage in natural conversations to improve fluency, analyze pronunciation and give real-time feedback, detect phonetic mistakes and provide corrections, and grade pronunciation accuracy and suggest improvements. The frontend is a chat-based conversational UI with voice and text support, the backend processes and stores conversation data, and the AI Component uses LLMs (GPT-4 / fine-tuned models) for realistic dialogue simulation and Whisper API / DeepSpeech for speech-to-text processing."},{"component":"Spaced Repetition & Revision Scheduling","description":"AI suggests revision schedules based on spaced repetition techniques. Users receive reminders for timely lesson reviews. Generates AI-powered summaries of past lessons for quick revision. The frontend displays recommended revision schedules and lesson summaries, the backend logs past lessons and user progress, and the AI Component uses spaced repetition algorithms (SM2) for retention optimization."}]}'''
     
     # Call the function and print the result
-    output = categorize_features(sample_requirement_json)
+    output = asyncio.run(categorize_features(sample_requirement_json))
     print(output)
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import re
+import time
+import asyncio
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from .metrics import Counter
+from .llm_cache import is_bypassed
+from .sqlite_store import SQLiteLRUStore
+
+# Documents larger than this are rejected before they are fully read
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Least recently used documents are evicted once the store exceeds this size
+DOWNLOAD_STORE_MAX_BYTES = int(os.getenv("DOWNLOAD_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "20"))
+
+DOWNLOADS = Counter(
+    "document_downloads_total",
+    "Document fetches by outcome: fresh (served from the store), not_modified, fetched or error.",
+    ("result",),
+)
+
+_MAX_AGE = re.compile(r"(?:s-)?max-age=(\d+)")
+
+_client = None
+
+
+class DownloadError(Exception):
+    """The document could not be downloaded."""
+
+
+class DownloadTooLarge(DownloadError):
+    """The document is larger than DOWNLOAD_MAX_BYTES."""
+
+
+class ContentStore(SQLiteLRUStore):
+    """
+    Downloaded documents keyed by URL, with the validators (ETag,
+    Last-Modified) and freshness lifetime the server sent. Backed by a SQLite
+    file shared by every worker on the host and kept across restarts.
+    """
+
+    table = "downloads"
+    key_column = "url"
+    columns = ("content BLOB NOT NULL", "etag TEXT", "last_modified TEXT", "expires_at REAL NOT NULL")
+
+    def __init__(self, path="downloads.db", max_bytes=DOWNLOAD_STORE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def get(self, url):
+        row = self._get(url, ("content", "etag", "last_modified", "expires_at"))
+        if row is None:
+            return None
+        return {"content": row[0], "etag": row[1], "last_modified": row[2], "expires_at": row[3]}
+
+    def put(self, url, content, etag, last_modified, expires_at):
+        self._put(url, len(content), content=content, etag=etag, last_modified=last_modified, expires_at=expires_at)
+
+    def refresh(self, url, expires_at):
+        """Extend the lifetime of a stored document after the server confirmed it is unchanged."""
+        self._update(url, expires_at=expires_at)
+
+
+def create_store():
+    """Build the store selected by DOWNLOAD_STORE ("sqlite" or "off")."""
+    backend = os.getenv("DOWNLOAD_STORE", "sqlite")
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return ContentStore(os.getenv("DOWNLOAD_STORE_PATH", "downloads.db"))
+    raise ValueError(f"Unknown download store: {backend}")
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    """Return the shared content store, or None when it is disabled."""
+    return create_store()
+
+
+def get_client():
+    """The shared pooled HTTP client, so repeated downloads reuse TLS connections."""
+    global _client
+    if _client is None:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            follow_redirects=True,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _expires_at(headers):
+    """
+    When a response stops being fresh, from Cache-Control max-age or Expires.
+    Without either it must be revalidated on every use; None means it must
+    not be stored at all.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    now = time.time()
+    if "no-cache" in cache_control:
+        return now
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        return now + int(match.group(1)) - int(headers.get("age", "0") or 0)
+    if headers.get("expires"):
+        try:
+            return parsedate_to_datetime(headers["expires"]).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now
+
+
+async def download(url):
+    """
+    Return the bytes of the document at `url`.
+
+    A stored copy that is still fresh is returned without any request. A
+    stale one is revalidated with If-None-Match / If-Modified-Since, so an
+    unchanged document costs a 304 rather than a transfer. Inside
+    `bypass_cache()` stored copies are always revalidated. Raises
+    DownloadError (or DownloadTooLarge past DOWNLOAD_MAX_BYTES).
+    """
+    import httpx
+
+    store = get_store()
+    cached = await asyncio.to_thread(store.get, url) if store is not None else None
+    if cached is not None and not is_bypassed() and cached["expires_at"] > time.time():
+        DOWNLOADS.inc(result="fresh")
+        return cached["content"]
+
+    headers = {}
+    if cached is not None:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        async with get_client().stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                expires_at = _expires_at(response.headers)
+                if expires_at is not None:
+                    await asyncio.to_thread(store.refresh, url, expires_at)
+                DOWNLOADS.inc(result="not_modified")
+                return cached["content"]
+            response.raise_for_status()
+            length = response.headers.get("content-length")
+            if length and int(length) > DOWNLOAD_MAX_BYTES:
+                raise DownloadTooLarge(f"Document is {length} bytes, the limit is {DOWNLOAD_MAX_BYTES}")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > DOWNLOAD_MAX_BYTES:
+                    raise DownloadTooLarge(f"Document exceeds the {DOWNLOAD_MAX_BYTES} byte limit")
+    except httpx.HTTPError as e:
+        DOWNLOADS.inc(result="error")
+        raise DownloadError(str(e)) from e
+    except DownloadTooLarge:
+        DOWNLOADS.inc(result="error")
+        raise
+
+    content = bytes(body)
+    expires_at = _expires_at(response.headers)
+    if store is not None and expires_at is not None:
+        await asyncio.to_thread(
+            store.put, url, content, response.headers.get("etag"), response.headers.get("last-modified"), expires_at
+        )
+    DOWNLOADS.inc(result="fetched")
+    return content
@@ -0,0 +1,123 @@
+import os
+import math
+import threading
+from collections import deque
+from .metrics import Counter
+from .prompts import count_tokens, model_limits
+
+# Send a backup request once a call has taken longer than this percentile of earlier calls
+HEDGING = os.getenv("LLM_HEDGING", "on") != "off"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Slow calls are not hedged until this many calls have been timed
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Per-call budget: a call costs at most 1 + this many completions
+HEDGE_MAX_EXTRA = int(os.getenv("LLM_HEDGE_MAX_EXTRA", "1"))
+# Send backups to the other provider (GitHub Models <-> Together) instead of repeating the request
+HEDGE_ALTERNATE = os.getenv("LLM_HEDGE_ALTERNATE", "off") == "on"
+HEDGE_WINDOW = 200
+
+ALTERNATES = {
+    "github": ("together", "mistralai/Mistral-7B-Instruct-v0.3", "TOGETHER_API_KEY"),
+    "together": ("github", "gpt-4o", "GITHUB_TOKEN"),
+}
+# Sampling parameters the OpenAI-compatible GitHub Models API rejects
+_TOGETHER_ONLY = ("top_k", "repetition_penalty")
+
+HEDGED_REQUESTS = Counter(
+    "llm_hedged_requests_total",
+    "Backup LLM requests by the provider/model they were sent to; result is sent or won.",
+    ("provider", "model", "result"),
+)
+
+
+class LatencyTracker:
+    """
+    Recent completion latencies per call site, provider and model. A request
+    abandoned because a backup won is recorded as censored: it only shows the
+    latency was at least that long.
+    """
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds, censored=False):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append((seconds, censored))
+
+    def percentile(self, key, percentile):
+        """
+        The given percentile of the recorded latencies, or None with too few
+        samples. Read off the Kaplan-Meier estimate, so censored samples count
+        as "slower than this" instead of being dropped; without censored
+        samples this is the plain sample percentile.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        survival, at_risk = 1.0, len(samples)
+        for seconds, censored in samples:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival >= percentile / 100 - 1e-9:
+                    return seconds
+            at_risk -= 1
+        # Too many calls were abandoned to see that far into the tail
+        return samples[-1][0]
+
+
+_tracker = LatencyTracker()
+
+
+def observe_latency(key, seconds, censored=False):
+    _tracker.observe(key, seconds, censored)
+
+
+def hedge_delay(key):
+    """
+    Seconds to wait for a response before sending a backup, or None when
+    hedging is off or the call site has too few timed calls yet.
+    """
+    if not HEDGING:
+        return None
+    return _tracker.percentile(key, HEDGE_PERCENTILE)
+
+
+def alternate_route(provider, params):
+    """
+    The same request addressed to the other provider, or None if that isn't
+    enabled, has no credentials or can't fit the prompt.
+    """
+    if not HEDGE_ALTERNATE or provider not in ALTERNATES:
+        return None
+    other, model, credential = ALTERNATES[provider]
+    if not os.getenv(credential):
+        return None
+    limits = model_limits(model)
+    prompt_tokens = sum(count_tokens(message.get("content") or "") for message in params.get("messages", ()))
+    max_tokens = min(params.get("max_tokens", 0), limits["max_output"])
+    if prompt_tokens + max_tokens > limits["context"]:
+        return None
+    params = dict(params, model=model)
+    if other == "github":
+        for name in _TOGETHER_ONLY:
+            params.pop(name, None)
+    if "max_tokens" in params:
+        params["max_tokens"] = max_tokens
+    return other, params
+
+
+def hedge_routes(provider, params, max_extra):
+    """
+    The primary (provider, params) followed by up to `max_extra` backups,
+    alternating between the other provider (when enabled) and the primary.
+    """
+    primary = (provider, params)
+    alternate = alternate_route(provider, params)
+    backups = [alternate, primary] if alternate else [primary]
+    return [primary] + [backups[index % len(backups)] for index in range(max_extra)]
@@ -0,0 +1,266 @@
+import os
+import abc
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+import orjson
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Finished jobs are dropped from the store after this many seconds
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+DEFAULT_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+# Unfinished jobs whose process stops renewing them for this long are marked failed
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+
+
+def _new_job(kind):
+    return {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": QUEUED,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+class JobStore(abc.ABC):
+    """
+    Interface for job state storage. Jobs are plain dicts (see `_new_job`).
+    Each job is leased to the process (`owner`) that runs it, so a store
+    shared by several workers only fails the jobs of processes that stopped.
+    """
+
+    @abc.abstractmethod
+    def create(self, job, owner):
+        """Store a new job, leased to `owner` for JOB_LEASE_SECONDS."""
+
+    @abc.abstractmethod
+    def update(self, job_id, **fields):
+        pass
+
+    @abc.abstractmethod
+    def get(self, job_id):
+        pass
+
+    @abc.abstractmethod
+    def purge(self, finished_before):
+        """Delete finished jobs older than the given timestamp."""
+
+    @abc.abstractmethod
+    def renew(self, owner):
+        """Extend the lease on the unfinished jobs of `owner`."""
+
+    @abc.abstractmethod
+    def fail_expired(self, error):
+        """Mark queued or running jobs whose lease has run out as failed."""
+
+
+class InMemoryJobStore(JobStore):
+    """Job store local to the current process."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job, owner):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def purge(self, finished_before):
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["finished_at"] is not None and job["finished_at"] < finished_before
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def renew(self, owner):
+        # Only the current process can see these jobs
+        pass
+
+    def fail_expired(self, error):
+        pass
+
+
+class SQLiteJobStore(JobStore):
+    """Job store backed by a SQLite file, shared by every worker on the host."""
+
+    _COLUMNS = ("id", "kind", "status", "result", "error", "created_at", "started_at", "finished_at")
+
+    def __init__(self, path="jobs.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result BLOB,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                owner TEXT,
+                lease_until REAL
+            )
+            """
+        )
+        self._lock = threading.Lock()
+
+    def create(self, job, owner):
+        row = dict(job, result=orjson.dumps(job["result"]), owner=owner, lease_until=time.time() + JOB_LEASE_SECONDS)
+        columns = (*self._COLUMNS, "owner", "lease_until")
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [row[column] for column in columns],
+            )
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = orjson.dumps(fields["result"])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self._COLUMNS, row))
+        job["result"] = orjson.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def purge(self, finished_before):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (finished_before,)
+            )
+
+    def renew(self, owner):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time() + JOB_LEASE_SECONDS, owner, QUEUED, RUNNING),
+            )
+
+    def fail_expired(self, error):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) AND lease_until < ?",
+                (FAILED, error, now, QUEUED, RUNNING, now),
+            )
+
+
+def create_job_store():
+    """Build the job store selected by JOB_STORE ("memory" or "sqlite")."""
+    backend = os.getenv("JOB_STORE", "memory")
+    if backend == "memory":
+        return InMemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(os.getenv("JOB_STORE_PATH", "jobs.db"))
+    raise ValueError(f"Unknown job store: {backend}")
+
+
+def concurrency_for(kind):
+    """Worker count for a job kind, e.g. JOB_CONCURRENCY_GENERATE_WIREFRAME=2."""
+    env_name = "JOB_CONCURRENCY_" + kind.upper().replace("-", "_")
+    return int(os.getenv(env_name, DEFAULT_CONCURRENCY))
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a bounded pool of workers per job kind.
+
+    Args:
+        store (JobStore): Where job status and results are kept
+        handlers (dict): Job kind -> coroutine function taking the job payload
+            and returning a JSON-serializable result
+    """
+
+    def __init__(self, store, handlers):
+        self.store = store
+        self.handlers = handlers
+        # Identifies this process's jobs in a store shared with other workers
+        self.owner = uuid.uuid4().hex
+        self._queues = {}
+        self._workers = []
+
+    async def start(self):
+        # Store calls run in a thread: the SQLite store blocks on disk and on other processes' locks
+        await asyncio.to_thread(self.store.fail_expired, "Job interrupted by server restart")
+        for kind in self.handlers:
+            queue = self._queues[kind] = asyncio.Queue()
+            for _ in range(concurrency_for(kind)):
+                self._workers.append(asyncio.create_task(self._worker(kind, queue)))
+        self._workers.append(asyncio.create_task(self._keep_leases()))
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, kind, payload):
+        """Queue a job and return its initial record."""
+        if kind not in self.handlers:
+            raise KeyError(kind)
+        await asyncio.to_thread(self.store.purge, time.time() - JOB_RETENTION_SECONDS)
+        job = _new_job(kind)
+        await asyncio.to_thread(self.store.create, job, self.owner)
+        self._queues[kind].put_nowait((job["id"], payload))
+        return job
+
+    async def get(self, job_id):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _keep_leases(self):
+        """Renew this process's jobs, and fail those of processes that stopped renewing theirs."""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 4)
+            await asyncio.to_thread(self.store.renew, self.owner)
+            await asyncio.to_thread(self.store.fail_expired, "Job interrupted by server restart")
+
+    async def _worker(self, kind, queue):
+        handler = self.handlers[kind]
+        while True:
+            job_id, payload = await queue.get()
+            try:
+                await asyncio.to_thread(self.store.update, job_id, status=RUNNING, started_at=time.time())
+                result = await handler(payload)
+                await asyncio.to_thread(
+                    self.store.update, job_id, status=SUCCEEDED, result=result, finished_at=time.time()
+                )
+            except asyncio.CancelledError:
+                # Shutting down: write synchronously, awaiting here could be cancelled again
+                self.store.update(job_id, status=FAILED, error="Job cancelled", finished_at=time.time())
+                raise
+            except Exception as e:
+                print(f"Job {job_id} ({kind}) failed: {e}")
+                await asyncio.to_thread(self.store.update, job_id, status=FAILED, error=str(e), finished_at=time.time())
+            finally:
+                queue.task_done()
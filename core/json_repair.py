@@ -0,0 +1,335 @@
+import re
+import copy
+import orjson
+from .metrics import Counter
+
+JSON_REPAIRS = Counter(
+    "llm_json_repairs_total",
+    "Model outputs parsed only after local repair: extracted (surrounding text or fence dropped), "
+    "repaired (syntax fixed) or salvaged (truncated output cut back to the last complete item).",
+    ("repair",),
+)
+
+_FENCE = re.compile(r"```[\w-]*[ \t]*\n?(.*?)(?:```|$)", re.DOTALL)
+_STRING = re.compile(r'"(?:[^"\\\x00-\x1f]|\\.)*"')
+_NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_LITERALS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+# Truncated output is cut back at most this many complete items looking for a valid value
+MAX_SALVAGE_ATTEMPTS = 50
+
+_TYPES = {
+    "object": lambda value: isinstance(value, dict),
+    "array": lambda value: isinstance(value, list),
+    "string": lambda value: isinstance(value, str),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+}
+
+
+class JSONRepairError(ValueError):
+    """No JSON value matching the schema could be recovered from the text."""
+
+
+def _check(value, schema, path):
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_TYPES[name](value) for name in types):
+            raise ValueError(f"{path}: expected {expected}, got {type(value).__name__}")
+    if isinstance(value, dict):
+        for name in schema.get("required", ()):
+            if name not in value:
+                raise ValueError(f"{path}: missing '{name}'")
+        for name, subschema in schema.get("properties", {}).items():
+            if name in value:
+                _check(value[name], subschema, f"{path}.{name}")
+            elif "default" in subschema:
+                value[name] = copy.deepcopy(subschema["default"])
+    elif isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            _check(item, schema["items"], f"{path}[{index}]")
+
+
+def validate(value, schema):
+    """
+    Check a parsed value against `schema` and return it, with defaults filled in.
+
+    `schema` is a pydantic model class, or a dict using a small subset of
+    JSON Schema: "type", "properties", "required", "items" and "default".
+    Raises ValueError on a mismatch.
+    """
+    if schema is None:
+        return value
+    if isinstance(schema, type):
+        if hasattr(schema, "model_validate"):
+            return schema.model_validate(value).model_dump()
+        return schema.parse_obj(value).dict()
+    _check(value, schema, "$")
+    return value
+
+
+def _read_string(text, start):
+    """Read the string literal starting at `start`. Returns (JSON literal, end index, closed)."""
+    match = _STRING.match(text, start)
+    if match:
+        return match.group(0), match.end(), True
+    # Raw control characters or no closing quote: escape them one by one
+    chars = ['"']
+    index, length = start + 1, len(text)
+    while index < length:
+        char = text[index]
+        if char == "\\" and index + 1 < length:
+            chars.append(text[index:index + 2])
+            index += 2
+            continue
+        if char == '"':
+            chars.append('"')
+            return "".join(chars), index + 1, True
+        if char < " ":
+            chars.append(_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+        else:
+            chars.append(char)
+        index += 1
+    chars.append('"')
+    return "".join(chars), length, False
+
+
+def _read_single_quoted(text, start):
+    """Read a Python-style 'string'. Returns (JSON literal, end index, closed)."""
+    index, length = start + 1, len(text)
+    chars = []
+    while index < length:
+        char = text[index]
+        if char == "\\" and index + 1 < length:
+            chars.append(text[index + 1] if text[index + 1] == "'" else text[index:index + 2])
+            index += 2
+            continue
+        if char == "'":
+            return orjson.dumps("".join(chars)).decode(), index + 1, True
+        chars.append(char)
+        index += 1
+    return orjson.dumps("".join(chars)).decode(), length, False
+
+
+def _separate(out, stack):
+    """Insert the comma a model left out between two values."""
+    if stack and out and out[-1] not in ("[", "{", ",", ":"):
+        out.append(",")
+
+
+def _trim(out, in_object, key_start=None):
+    """Drop a trailing comma, and a dangling key or colon, before a container is closed."""
+    while out and out[-1] == ",":
+        out.pop()
+    if in_object and out:
+        if out[-1] == ":":
+            out.pop()
+            out.pop()
+        elif key_start is not None and len(out) == key_start + 1:
+            del out[key_start:]
+        while out and out[-1] == ",":
+            out.pop()
+
+
+def _close(out, stack, key_start=None):
+    out = list(out)
+    for opener in reversed(stack):
+        _trim(out, opener == "{", key_start)
+        key_start = None
+        out.append(_CLOSERS[opener])
+    return "".join(out)
+
+
+def _repair(text):
+    """
+    Rewrite the JSON value at the start of `text` as valid JSON in one pass.
+
+    Returns (repaired text, fallbacks). Fallbacks are only produced for
+    truncated input: the value cut after each complete array element, last
+    first.
+    """
+    out, stack = [], []
+    # (len(out), len(stack)) after each complete array element, while that array is open
+    safe_points = []
+    key_start = None
+    index, length = 0, len(text)
+    while index < length:
+        char = text[index]
+        if char in " \t\r\n":
+            index += 1
+        elif char == '"' or char == "'":
+            read = _read_string if char == '"' else _read_single_quoted
+            literal, index, closed = read(text, index)
+            if not closed:
+                # Truncated inside a string: keep a value, drop a half-written key
+                if stack and stack[-1] == "{" and (not out or out[-1] in ("{", ",")):
+                    break
+            _separate(out, stack)
+            key_start = len(out) if stack and stack[-1] == "{" and out and out[-1] in ("{", ",") else None
+            out.append(literal)
+        elif char in "{[":
+            _separate(out, stack)
+            stack.append(char)
+            out.append(char)
+            key_start = None
+            index += 1
+        elif char in "}]":
+            index += 1
+            if not stack:
+                continue
+            opener = "{" if char == "}" else "["
+            if opener in stack:
+                # Close whatever was left open inside the container being closed
+                while stack[-1] != opener:
+                    _trim(out, stack[-1] == "{", key_start)
+                    key_start = None
+                    out.append(_CLOSERS[stack.pop()])
+            else:
+                opener = stack[-1]
+            _trim(out, opener == "{", key_start)
+            key_start = None
+            out.append(_CLOSERS[opener])
+            stack.pop()
+            while safe_points and safe_points[-1][1] > len(stack):
+                safe_points.pop()
+            if not stack:
+                break
+            if stack[-1] == "[":
+                safe_points.append((len(out), len(stack)))
+        elif char == ",":
+            index += 1
+            if stack and stack[-1] == "[" and out and out[-1] not in ("[", ","):
+                safe_points.append((len(out), len(stack)))
+            if out and out[-1] not in ("[", "{", ",", ":"):
+                out.append(",")
+        elif char == ":":
+            index += 1
+            if out and out[-1] != ":":
+                out.append(":")
+        elif char == "-" or char == "." or char.isdigit():
+            match = _NUMBER.match(text, index)
+            if not match:
+                index += 1
+                continue
+            number = match.group(0)
+            if number.endswith("."):
+                number += "0"
+            if number.lstrip("-").startswith("."):
+                number = number.replace(".", "0.", 1)
+            _separate(out, stack)
+            out.append(number)
+            index = match.end()
+        elif char == "/" and text.startswith("//", index):
+            end = text.find("\n", index)
+            index = length if end < 0 else end
+        elif char == "/" and text.startswith("/*", index):
+            end = text.find("*/", index)
+            index = length if end < 0 else end + 2
+        elif char.isalpha() or char == "_":
+            match = _WORD.match(text, index)
+            word = match.group(0)
+            index = match.end()
+            in_key_position = stack and stack[-1] == "{" and out and out[-1] in ("{", ",")
+            if word in _LITERALS:
+                _separate(out, stack)
+                out.append(_LITERALS[word])
+            elif in_key_position:
+                # Unquoted key
+                _separate(out, stack)
+                key_start = len(out)
+                out.append(orjson.dumps(word).decode())
+            elif index == length:
+                # Literal cut off at the end, e.g. "tru"
+                literal = next((value for value in ("true", "false", "null") if value.startswith(word)), None)
+                if literal:
+                    _separate(out, stack)
+                    out.append(literal)
+        else:
+            index += 1
+
+    if not stack:
+        return "".join(out), []
+    fallbacks = (
+        _close(out[:size], stack[:depth])
+        for size, depth in reversed(safe_points[-MAX_SALVAGE_ATTEMPTS:])
+    )
+    return _close(out, stack, key_start), fallbacks
+
+
+def _value_start(text, schema):
+    """Index of the bracket opening the JSON value, preferring the type the schema expects."""
+    expected = schema.get("type") if isinstance(schema, dict) else "object" if schema is not None else None
+    if expected == "object":
+        return text.find("{")
+    if expected == "array":
+        return text.find("[")
+    starts = [position for position in (text.find("{"), text.find("[")) if position >= 0]
+    return min(starts) if starts else -1
+
+
+def _candidates(text, schema):
+    yield "clean", text
+    fence = _FENCE.search(text)
+    body = fence.group(1) if fence and ("{" in fence.group(1) or "[" in fence.group(1)) else text
+    start = _value_start(body, schema)
+    if start < 0:
+        return
+    body = body[start:]
+    end = max(body.rfind("}"), body.rfind("]")) + 1
+    if end > 0 and body[:end] != text:
+        yield "extracted", body[:end]
+    repaired, fallbacks = _repair(body)
+    yield "repaired", repaired
+    for fallback in fallbacks:
+        yield "salvaged", fallback
+
+
+def parse_json(text, schema=None):
+    """
+    Parse the JSON value in a model response, repairing it locally if needed.
+
+    Tries the text as is, then the value inside a ``` fence or between the
+    outermost brackets, then a repaired copy: trailing commas dropped,
+    missing commas inserted, raw control characters in strings escaped,
+    Python-style quotes and literals, unquoted keys and comments fixed, and
+    unclosed strings and brackets closed. Truncated output is finally cut back to its last complete array
+    element. The first candidate that parses and satisfies `schema` (see
+    `validate`) is returned.
+
+    Raises:
+        JSONRepairError: if no valid value can be recovered.
+    """
+    if not isinstance(text, str):
+        raise JSONRepairError(f"Expected model output text, got {type(text).__name__}")
+    text = text.strip()
+    error = "no JSON value found"
+    for repair, candidate in _candidates(text, schema):
+        try:
+            value = orjson.loads(candidate)
+        except orjson.JSONDecodeError as e:
+            error = f"invalid JSON ({e})"
+            continue
+        try:
+            value = validate(value, schema)
+        except ValueError as e:
+            error = f"does not match the schema ({e})"
+            continue
+        if repair != "clean":
+            JSON_REPAIRS.inc(repair=repair)
+        return value
+    raise JSONRepairError(f"Could not recover JSON from the model output: {error}")
+
+
+def is_json(text, schema=None):
+    """True when a JSON value matching `schema` can be recovered from the text."""
+    try:
+        parse_json(text, schema)
+        return True
+    except JSONRepairError:
+        return False
@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from contextlib import contextmanager
+from contextvars import ContextVar
+import orjson
+from .metrics import Counter
+from .sqlite_store import SQLiteLRUStore
+
+# Entries older than this are treated as missing
+CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 86400)))
+# Least recently used entries are evicted once stored responses exceed this size
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+CACHE_HITS = Counter("llm_cache_hits_total", "LLM calls answered from the response cache.", ("provider", "model"))
+CACHE_MISSES = Counter("llm_cache_misses_total", "LLM calls not found in the response cache.", ("provider", "model"))
+
+_bypass = ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_cache():
+    """Skip cache lookups for LLM calls made inside the block. Fresh responses are still stored."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def is_bypassed():
+    return _bypass.get()
+
+
+def cache_key(provider, params):
+    """
+    Content address of a completion request: the provider plus every request
+    parameter (model, messages, sampling settings), with keys sorted.
+    """
+    canonical = orjson.dumps(
+        {"provider": provider, "params": params}, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+    )
+    return hashlib.sha256(canonical).hexdigest()
+
+
+class InMemoryCache:
+    """LRU response cache local to the current process."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if time.time() - created_at > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time())
+            self._size += len(value)
+            while self._size > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class SQLiteCache(SQLiteLRUStore):
+    """Response cache backed by a SQLite file, shared by every worker on the host and kept across restarts."""
+
+    table = "responses"
+    columns = ("value BLOB NOT NULL", "created_at REAL NOT NULL")
+
+    def __init__(self, path="llm_cache.db", max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+        super().__init__(path, max_bytes)
+        self.ttl = ttl
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+
+    def get(self, key):
+        row = self._get(key, ("value", "created_at"))
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            with self._lock:
+                self._delete([key])
+            return None
+        return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        self._put(key, len(value), value=value, created_at=now)
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+
+
+def create_cache():
+    """Build the cache selected by LLM_CACHE ("sqlite", "memory" or "off")."""
+    backend = os.getenv("LLM_CACHE", "sqlite")
+    if backend == "off":
+        return None
+    if backend == "memory":
+        return InMemoryCache()
+    if backend == "sqlite":
+        return SQLiteCache(os.getenv("LLM_CACHE_PATH", "llm_cache.db"))
+    raise ValueError(f"Unknown LLM cache: {backend}")
+
+
+@lru_cache(maxsize=None)
+def get_cache():
+    """Return the shared cache, or None when caching is disabled."""
+    return create_cache()
+
+
+async def lookup(provider, params):
+    """
+    Return the cached completion text for a request, or None on a miss.
+    Records hit/miss metrics; always misses inside `bypass_cache()`. The
+    cache is read in a worker thread, off the event loop.
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+    model = params.get("model", "unknown")
+    value = None if is_bypassed() else await asyncio.to_thread(cache.get, cache_key(provider, params))
+    if value is None:
+        CACHE_MISSES.inc(provider=provider, model=model)
+        return None
+    CACHE_HITS.inc(provider=provider, model=model)
+    return orjson.loads(value)["content"]
+
+
+async def store(provider, params, content):
+    """Save the completion text for a request, in a worker thread."""
+    cache = get_cache()
+    if cache is None or content is None:
+        return
+    await asyncio.to_thread(cache.put, cache_key(provider, params), orjson.dumps({"content": content}))
@@ -0,0 +1,336 @@
+import os
+import time
+import asyncio
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from . import llm_cache
+from .llm_transport import LIVE, RECORD, REPLAY, get_fixture_store, transport_mode
+from .hedging import HEDGE_MAX_EXTRA, HEDGED_REQUESTS, hedge_delay, hedge_routes, observe_latency
+from .metrics import LLM_REQUEST_DURATION, LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS, LLM_ERRORS
+from .rate_limit import get_limiter, is_retryable, run_rate_limited
+from .tracing import span
+
+# Load API keys from .env file
+load_dotenv()
+
+# Point these at a local stand-in server (see llm_stub_server) to run without the real providers
+GITHUB_MODELS_BASE_URL = os.getenv("LLM_BASE_URL_GITHUB", "https://models.inference.ai.azure.com")
+TOGETHER_BASE_URL = os.getenv("LLM_BASE_URL_TOGETHER")
+
+# Upper bound on open connections per provider, shared by every subsystem
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+
+_clients = {}
+_together_session = None
+
+
+def _build_client(provider):
+    """
+    Create the async client for a provider ("github" or "together").
+    SDKs are imported here so importing this module stays cheap.
+    """
+    if provider == "github":
+        import httpx
+        from openai import AsyncOpenAI
+
+        if not os.getenv("GITHUB_TOKEN"):
+            raise RuntimeError("GITHUB_TOKEN is not set; GitHub Models calls are unavailable.")
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+        )
+        return AsyncOpenAI(
+            base_url=GITHUB_MODELS_BASE_URL,
+            api_key=os.environ["GITHUB_TOKEN"],
+            http_client=http_client,
+            # 429s are retried by core.rate_limit, which shares the backoff across callers
+            max_retries=0,
+        )
+    if provider == "together":
+        from together import AsyncTogether
+
+        if not os.getenv("TOGETHER_API_KEY"):
+            raise RuntimeError("TOGETHER_API_KEY is not set; Together calls are unavailable.")
+        return AsyncTogether(api_key=os.getenv("TOGETHER_API_KEY"), base_url=TOGETHER_BASE_URL, max_retries=0)
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def get_client(provider):
+    """Return the shared async client for a provider, building it on first use."""
+    client = _clients.get(provider)
+    if client is None:
+        client = _clients[provider] = _build_client(provider)
+    return client
+
+
+async def init_clients():
+    """
+    Build every configured provider client once. Called from the app startup
+    hook. Providers without credentials are skipped and fail on first use.
+    """
+    global _together_session
+    if transport_mode() == REPLAY:
+        # Replayed calls are served from fixtures, no clients or credentials needed
+        return
+    for provider in ("github", "together"):
+        try:
+            get_client(provider)
+        except RuntimeError as e:
+            print(f"⚠️ {e}")
+    if "together" in _clients and _together_session is None:
+        import aiohttp
+
+        # The Together SDK opens a new aiohttp session per request unless one
+        # is supplied through its `aiosession` context variable.
+        _together_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+        )
+
+
+async def close_clients():
+    """Close pooled connections. Called from the app shutdown hook."""
+    global _together_session
+    github_client = _clients.pop("github", None)
+    if github_client is not None:
+        await github_client.close()
+    _clients.pop("together", None)
+    if _together_session is not None:
+        await _together_session.close()
+        _together_session = None
+
+
+def _text_completion(model, content):
+    """Minimal stand-in for a completion response, exposing `choices[0].message.content`."""
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(
+        model=model,
+        choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        usage=None,
+    )
+
+
+async def chat_completion(provider, cache=True, cache_check=None, **params):
+    """
+    Run a chat completion against the given provider without blocking the event loop.
+    Calls are scheduled by the provider/model rate limiter (see core.rate_limit)
+    and answered from the response cache when the same request was made before
+    (see core.llm_cache). LLM_TRANSPORT=record/replay saves or serves
+    completions as fixtures instead (see core.llm_transport).
+
+    Args:
+        provider (str): "github" for GitHub Models (gpt-4o) or "together" for Together
+        cache (bool): Set to False to skip the cache lookup (the response is still stored)
+        cache_check (callable, optional): Called with the generated text; the
+            response is only cached when it returns True
+        **params: Keyword arguments forwarded to `client.chat.completions.create`
+
+    Returns:
+        The provider's chat completion response object.
+    """
+    model = params.get("model", "unknown")
+    mode = transport_mode()
+    if mode == REPLAY:
+        return _text_completion(model, get_fixture_store().load(provider, params))
+    # Recording must see every call, so the cache is only used against live providers
+    use_cache = mode == LIVE
+    if cache and use_cache:
+        content = await llm_cache.lookup(provider, params)
+        if content is not None:
+            return _text_completion(model, content)
+
+    with span(f"llm.{provider}", model=model):
+        started = time.perf_counter()
+        try:
+            response = await run_rate_limited(provider, model, lambda: _create(provider, **params))
+            if mode == RECORD and response.choices:
+                get_fixture_store().save(provider, params, response.choices[0].message.content)
+        except Exception:
+            LLM_ERRORS.inc(provider=provider, model=model)
+            raise
+        finally:
+            LLM_REQUEST_DURATION.observe(time.perf_counter() - started, provider=provider, model=model)
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        LLM_PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, provider=provider, model=model)
+        LLM_COMPLETION_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, provider=provider, model=model)
+
+    content = response.choices[0].message.content if response.choices else None
+    if use_cache and content is not None and (cache_check is None or cache_check(content)):
+        await llm_cache.store(provider, params, content)
+    return response
+
+
+async def hedged_completion(provider, cache_check=None, name=None, max_extra=None, **params):
+    """
+    Run a chat completion, hedging against slow or unusable responses.
+
+    If no response has arrived after the LLM_HEDGE_PERCENTILE latency of
+    earlier calls from the same call site (`name`), a backup request is sent,
+    to the other provider when LLM_HEDGE_ALTERNATE=on. No such backups are
+    sent until the site has LLM_HEDGE_MIN_SAMPLES timed calls. A response
+    failing `cache_check`, or a retryable error (429, 5xx, timeout,
+    connection failure), sends the next backup straight away; any other
+    error (auth, bad request, missing credentials) is raised without further
+    requests. Backups for slow responses are only sent when the rate limiter
+    has a free slot for them, so they never queue behind real traffic. The first
+    response that passes `cache_check` is returned and the other requests are
+    cancelled. At most `max_extra` (default LLM_HEDGE_MAX_EXTRA) backups are
+    sent per call.
+
+    Takes the same arguments as `chat_completion`. Returns the last response
+    received when none passes `cache_check`, and raises the last error when
+    every request failed. Recorded and replayed calls are never hedged.
+    """
+    if transport_mode() != LIVE:
+        return await chat_completion(provider, cache_check=cache_check, **params)
+    model = params.get("model", "unknown")
+    content = await llm_cache.lookup(provider, params)
+    if content is not None and (cache_check is None or cache_check(content)):
+        return _text_completion(model, content)
+
+    routes = hedge_routes(provider, params, HEDGE_MAX_EXTRA if max_extra is None else max_extra)
+    delay = hedge_delay((name or model, provider, model))
+    pending = {}
+    sent = 0
+    last_response = last_error = None
+    # Set once a request fails in a way a repeat would too
+    exhausted = False
+
+    def send():
+        nonlocal sent
+        route_provider, route_params = routes[sent]
+        route_model = route_params.get("model", "unknown")
+        task = asyncio.create_task(
+            chat_completion(route_provider, cache=False, cache_check=cache_check, **route_params)
+        )
+        pending[task] = (route_provider, route_model, time.perf_counter(), sent > 0)
+        if sent > 0:
+            HEDGED_REQUESTS.inc(provider=route_provider, model=route_model, result="sent")
+        sent += 1
+
+    send()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=delay if sent < len(routes) and not exhausted else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                # Slower than usual: race a backup against the requests in flight,
+                # unless it would only queue behind them in the rate limiter
+                route_provider, route_params = routes[sent]
+                if get_limiter(route_provider, route_params.get("model", "unknown")).has_capacity():
+                    send()
+                continue
+            for task in done:
+                route_provider, route_model, started, backup = pending.pop(task)
+                try:
+                    response = task.result()
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable(e):
+                        exhausted = True
+                    continue
+                text = response.choices[0].message.content if response.choices else None
+                if cache_check is None or (text is not None and cache_check(text)):
+                    now = time.perf_counter()
+                    observe_latency((name or model, route_provider, route_model), now - started)
+                    # The requests it beat took at least this long
+                    for other, (other_provider, other_model, other_started, _) in pending.items():
+                        if not other.done():
+                            observe_latency((name or model, other_provider, other_model), now - other_started, censored=True)
+                    if backup:
+                        HEDGED_REQUESTS.inc(provider=route_provider, model=route_model, result="won")
+                    return response
+                last_response = response
+            if not pending and sent < len(routes) and not exhausted:
+                # Everything in flight failed, no point waiting for the timer
+                send()
+    finally:
+        for task in pending:
+            task.cancel()
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+
+async def _create(provider, **params):
+    client = get_client(provider)
+    if provider == "together" and _together_session is not None:
+        import together
+
+        token = together.aiosession.set(_together_session)
+        try:
+            return await client.chat.completions.create(**params)
+        finally:
+            together.aiosession.reset(token)
+    return await client.chat.completions.create(**params)
+
+
+async def chat_completion_stream(provider, cache=True, cache_check=None, **params):
+    """
+    Stream a chat completion, yielding content deltas as they arrive. A cached
+    response is yielded as a single piece.
+
+    Args:
+        provider (str): "github" or "together"
+        cache (bool): Set to False to skip the cache lookup
+        cache_check (callable, optional): As for `chat_completion`
+        **params: Keyword arguments forwarded to `client.chat.completions.create`
+
+    Yields:
+        str: The next piece of generated text.
+    """
+    mode = transport_mode()
+    if mode == REPLAY:
+        yield get_fixture_store().load(provider, params)
+        return
+    use_cache = mode == LIVE
+    if cache and use_cache:
+        content = await llm_cache.lookup(provider, params)
+        if content is not None:
+            yield content
+            return
+
+    client = get_client(provider)
+    model = params.get("model", "unknown")
+    limiter = get_limiter(provider, model)
+    token = None
+    if provider == "together" and _together_session is not None:
+        import together
+
+        token = together.aiosession.set(_together_session)
+    started = time.perf_counter()
+    try:
+        attempt = 0
+        while True:
+            # The slot is held until the stream is drained
+            async with limiter.slot():
+                try:
+                    stream = await client.chat.completions.create(stream=True, **params)
+                except Exception as e:
+                    if not limiter.should_retry(e, attempt):
+                        raise
+                    attempt += 1
+                    continue
+                limiter.bucket.on_success()
+                pieces = []
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        pieces.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                content = "".join(pieces)
+                if mode == RECORD:
+                    get_fixture_store().save(provider, params, content)
+                if use_cache and (cache_check is None or cache_check(content)):
+                    await llm_cache.store(provider, params, content)
+                return
+    except Exception:
+        LLM_ERRORS.inc(provider=provider, model=model)
+        raise
+    finally:
+        LLM_REQUEST_DURATION.observe(time.perf_counter() - started, provider=provider, model=model)
+        if token is not None:
+            together.aiosession.reset(token)
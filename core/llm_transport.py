@@ -0,0 +1,68 @@
+import os
+import orjson
+from .llm_cache import cache_key
+
+# "live" calls the providers, "record" calls them and saves every completion
+# as a fixture, "replay" answers only from fixtures and never touches the network
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+
+FIXTURES_DIR = os.getenv("LLM_FIXTURES_DIR", os.path.join("fixtures", "llm"))
+
+
+def transport_mode():
+    mode = os.getenv("LLM_TRANSPORT", LIVE)
+    if mode not in (LIVE, RECORD, REPLAY):
+        raise ValueError(f"Unknown LLM transport: {mode}")
+    return mode
+
+
+class MissingFixture(RuntimeError):
+    """Raised in replay mode when no fixture was recorded for a request."""
+
+
+class FixtureStore:
+    """
+    Recorded completions, one JSON file per request named after its content
+    address (see core.llm_cache.cache_key), so fixtures are reviewable and
+    diff cleanly in version control.
+    """
+
+    def __init__(self, directory=FIXTURES_DIR):
+        self.directory = directory
+
+    def _path(self, provider, params):
+        return os.path.join(self.directory, f"{cache_key(provider, params)}.json")
+
+    def load(self, provider, params):
+        """Return the recorded completion text for a request."""
+        path = self._path(provider, params)
+        try:
+            with open(path, "rb") as file:
+                return orjson.loads(file.read())["content"]
+        except FileNotFoundError:
+            raise MissingFixture(
+                f"No recorded {provider} completion for model {params.get('model')} "
+                f"(expected {path}). Record it with LLM_TRANSPORT=record."
+            ) from None
+
+    def save(self, provider, params, content):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(provider, params)
+        fixture = {"provider": provider, "params": params, "content": content}
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(orjson.dumps(fixture, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS))
+        # Readers never see a half-written fixture
+        os.replace(temp_path, path)
+
+
+_store = None
+
+
+def get_fixture_store():
+    global _store
+    if _store is None:
+        _store = FixtureStore()
+    return _store
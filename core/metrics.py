@@ -0,0 +1,123 @@
+import threading
+
+# Latency buckets in seconds, sized for LLM calls that take from ~100ms to minutes
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    """A monotonically increasing value, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self):
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    """Distribution of observed values (e.g. latencies) in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        series = self._values.get(key)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = []
+        for key, (counts, total, observations) in self._values.items():
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {observations}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {observations}")
+        return lines
+
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for metric in _registry:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Metrics shared across subsystems
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Latency of HTTP requests by endpoint.", ("method", "endpoint", "status")
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "Latency of LLM completion calls.", ("provider", "model")
+)
+LLM_PROMPT_TOKENS = Counter(
+    "llm_prompt_tokens_total", "Prompt tokens sent to LLM providers.", ("provider", "model")
+)
+LLM_COMPLETION_TOKENS = Counter(
+    "llm_completion_tokens_total", "Completion tokens returned by LLM providers.", ("provider", "model")
+)
+LLM_ERRORS = Counter(
+    "llm_request_errors_total", "LLM completion calls that raised an error.", ("provider", "model")
+)
+INCREMENTAL_EXTRACTIONS = Counter(
+    "incremental_extractions_total", "Revised documents extracted from their changed sections only."
+)
+PARSE_FAILURES = Counter(
+    "llm_parse_failures_total", "LLM outputs that failed to parse, by parser.", ("parser",)
+)
+STAGE_DURATION = Histogram(
+    "stage_duration_seconds", "Time spent in traced pipeline stages.", ("stage",)
+)
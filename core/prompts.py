@@ -0,0 +1,87 @@
+import re
+import math
+import orjson
+
+# Context window and largest completion we request, in tokens
+MODEL_LIMITS = {
+    "gpt-4o": {"context": 128000, "max_output": 4096},
+    "mistralai/Mistral-7B-Instruct-v0.3": {"context": 32768, "max_output": 8192},
+}
+DEFAULT_MODEL_LIMITS = {"context": 8192, "max_output": 2048}
+
+# Extra room over the expected completion size, models rarely answer as compactly as the estimate
+OUTPUT_HEADROOM = 1.25
+
+# Words, symbols and line breaks (with their indentation) are each roughly one token
+_TOKEN_PIECE = re.compile(r"\w+|[^\w\s]|\s*\n\s*")
+
+
+def model_limits(model):
+    return MODEL_LIMITS.get(model, DEFAULT_MODEL_LIMITS)
+
+
+def _default(value):
+    # Pydantic models (v1 and v2) are serialized as their field dicts
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "dict"):
+        return value.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def compact_json(value):
+    """Serialize a value for a prompt without indentation or spaces, which only cost tokens."""
+    if isinstance(value, str):
+        return value
+    return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def count_tokens(text):
+    """
+    Estimate the token count of a prompt locally by counting words, symbols
+    and line breaks, charging long words extra. Deliberately a fixed
+    heuristic, not a tokenizer: it feeds `max_tokens`, which is part of the
+    response cache and fixture keys, so it must give the same answer on
+    every host and without network access.
+    """
+    return sum(1 + len(piece) // 8 for piece in _TOKEN_PIECE.findall(text))
+
+
+def output_budget(model, prompt, expected_tokens, minimum):
+    """
+    `max_tokens` for a call: the expected completion size plus headroom, at
+    least `minimum`, and never more than the model allows after the prompt.
+    """
+    limits = model_limits(model)
+    prompt_tokens = count_tokens(prompt)
+    available = limits["context"] - prompt_tokens
+    budget = max(minimum, math.ceil(expected_tokens * OUTPUT_HEADROOM))
+    budget = min(budget, limits["max_output"], available)
+    if budget < minimum:
+        print(f"⚠️ Prompt of ~{prompt_tokens} tokens leaves only {max(budget, 0)} tokens for the {model} response")
+    return max(budget, 1)
+
+
+def scaled_output_budget(model, prompt, ratio, minimum):
+    """Output budget for responses that grow with the input: `ratio` tokens out per token in."""
+    return output_budget(model, prompt, ratio * count_tokens(prompt), minimum)
+
+
+def split_to_fit(items, max_tokens, measure=None):
+    """
+    Group items into consecutive batches whose summed size stays within
+    `max_tokens`. `measure` returns an item's size (default: tokens of its
+    compact JSON). An item larger than the limit gets a batch of its own.
+    """
+    measure = measure or (lambda item: count_tokens(compact_json(item)))
+    batches, batch, size = [], [], 0
+    for item in items:
+        item_size = measure(item)
+        if batch and size + item_size > max_tokens:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(item)
+        size += item_size
+    if batch:
+        batches.append(batch)
+    return batches
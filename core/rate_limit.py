@@ -0,0 +1,261 @@
+import os
+import re
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from .metrics import Counter, Histogram
+
+# Request priorities: lower values are served first
+INTERACTIVE = 0
+BATCH = 1
+
+# Retries after a 429 before the error is surfaced to the caller
+MAX_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "4"))
+
+# Defaults per provider: requests per minute and concurrent requests.
+# Override with LLM_RPM_<PROVIDER>[_<MODEL>] / LLM_CONCURRENCY_<PROVIDER>[_<MODEL>].
+DEFAULT_LIMITS = {
+    "github": {"rpm": 15, "concurrency": 5},
+    "together": {"rpm": 60, "concurrency": 10},
+}
+
+RATE_LIMITED = Counter(
+    "llm_rate_limited_total", "LLM calls rejected with 429 by the provider.", ("provider", "model")
+)
+QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for the scheduler.", ("provider", "model", "priority")
+)
+
+_priority = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    """Run LLM calls made inside the block (and tasks started from it) at the given priority."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    """The priority LLM calls made here would run at."""
+    return _priority.get()
+
+
+class TokenBucket:
+    """
+    Requests-per-minute limiter. The rate backs off when the provider
+    returns 429 and recovers gradually on success.
+    """
+
+    def __init__(self, rpm, burst=None):
+        self.max_rate = rpm / 60.0
+        self.rate = self.max_rate
+        self.capacity = burst or max(1, rpm // 10)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep(max(wait, (1 - self.tokens) / self.rate))
+
+    def has_token(self):
+        """True when a request could be admitted without waiting."""
+        now = time.monotonic()
+        self._refill(now)
+        return self.blocked_until <= now and self.tokens >= 1
+
+    def on_success(self):
+        # Additive increase back towards the configured rate
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_rate_limited(self, retry_after):
+        # Multiplicative decrease, and no new requests until Retry-After has passed
+        self.rate = max(self.max_rate * 0.1, self.rate * 0.5)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class PrioritySemaphore:
+    """Concurrency limiter that hands free slots to the highest priority waiter first."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._order = itertools.count()
+
+    async def acquire(self, level):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (level, next(self._order), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+                break
+
+
+class ModelLimiter:
+    """Token bucket plus concurrency limit for one provider/model pair."""
+
+    def __init__(self, provider, model, rpm, concurrency):
+        self.provider = provider
+        self.model = model
+        # A full set of concurrent calls can start at once, then the rate applies
+        self.bucket = TokenBucket(rpm, burst=max(concurrency, rpm // 10))
+        self.slots = PrioritySemaphore(concurrency)
+
+    def has_capacity(self):
+        """True when a new call would start straight away instead of queueing."""
+        return self.slots.active < self.slots.limit and not self.slots._waiters and self.bucket.has_token()
+
+    @asynccontextmanager
+    async def slot(self):
+        level = _priority.get()
+        started = time.perf_counter()
+        # Wait for the rate before taking a slot, so waiting calls don't hold slots idle
+        await self.bucket.acquire()
+        await self.slots.acquire(level)
+        try:
+            QUEUE_WAIT.observe(
+                time.perf_counter() - started,
+                provider=self.provider, model=self.model,
+                priority="interactive" if level == INTERACTIVE else "batch",
+            )
+            yield
+        finally:
+            self.slots.release()
+
+    def should_retry(self, error, attempt):
+        """
+        Record a failed call. Returns True (after backing off) when the error
+        is a 429 that should be retried.
+        """
+        if not is_rate_limited(error) or attempt >= MAX_RATE_LIMIT_RETRIES:
+            return False
+        RATE_LIMITED.inc(provider=self.provider, model=self.model)
+        wait = retry_after_seconds(error, attempt)
+        print(f"⚠️ {self.provider}/{self.model} rate limited, retrying in {wait:.1f}s")
+        self.bucket.on_rate_limited(wait)
+        return True
+
+
+def _env_limit(name, provider, model, default):
+    model_key = re.sub(r"[^A-Za-z0-9]+", "_", model).upper().strip("_")
+    for env_name in (f"{name}_{provider.upper()}_{model_key}", f"{name}_{provider.upper()}"):
+        if os.getenv(env_name):
+            return int(os.environ[env_name])
+    return default
+
+
+_limiters = {}
+
+
+def get_limiter(provider, model):
+    """Return the shared limiter for a provider/model pair."""
+    key = (provider, model)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        defaults = DEFAULT_LIMITS.get(provider, {"rpm": 60, "concurrency": 10})
+        limiter = _limiters[key] = ModelLimiter(
+            provider,
+            model,
+            rpm=_env_limit("LLM_RPM", provider, model, defaults["rpm"]),
+            concurrency=_env_limit("LLM_CONCURRENCY", provider, model, defaults["concurrency"]),
+        )
+    return limiter
+
+
+def is_rate_limited(error):
+    """True for 429 errors from either SDK."""
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return status == 429
+
+
+# SDK and transport errors raised when a request never got an answer
+_CONNECTION_ERRORS = {"APIConnectionError", "APITimeoutError", "Timeout", "TransportError", "ServiceUnavailableError"}
+
+
+def is_retryable(error):
+    """
+    True when the same request may well succeed if sent again: 429s, 5xx
+    responses, timeouts and connection errors. Auth failures, bad requests
+    and missing credentials are not.
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in _CONNECTION_ERRORS for cls in type(error).__mro__)
+
+
+def retry_after_seconds(error, attempt):
+    """Seconds to wait after a 429: the Retry-After header if present, else exponential backoff."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    for header in ("retry-after-ms", "Retry-After-Ms"):
+        if header in headers:
+            try:
+                return float(headers[header]) / 1000
+            except (TypeError, ValueError):
+                pass
+    for header in ("retry-after", "Retry-After"):
+        if header in headers:
+            try:
+                return float(headers[header])
+            except (TypeError, ValueError):
+                pass
+    return min(60.0, 2.0 ** attempt)
+
+
+async def run_rate_limited(provider, model, func):
+    """
+    Run `func()` (one upstream LLM request) under the provider/model limits,
+    retrying after 429 responses.
+    """
+    limiter = get_limiter(provider, model)
+    attempt = 0
+    while True:
+        async with limiter.slot():
+            try:
+                result = await func()
+            except Exception as e:
+                if not limiter.should_retry(e, attempt):
+                    raise
+                attempt += 1
+                continue
+        limiter.bucket.on_success()
+        return result
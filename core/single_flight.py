@@ -0,0 +1,48 @@
+import asyncio
+import hashlib
+import orjson
+from .metrics import Counter
+
+COALESCED_CALLS = Counter(
+    "single_flight_coalesced_total", "Calls that joined an identical in-flight computation.", ("namespace",)
+)
+
+
+def request_key(namespace, payload):
+    """
+    Key identifying a request by its canonicalized body: keys are sorted so
+    field order and whitespace in the original JSON do not matter.
+    """
+    canonical = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return f"{namespace}:{hashlib.sha256(canonical).hexdigest()}"
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation whose
+    result (or exception) is delivered to every caller.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, func):
+        """
+        Run `func()` unless a call with `key` is already in flight, in which
+        case wait for that call's result instead.
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            COALESCED_CALLS.inc(namespace=key.split(":", 1)[0])
+        # A caller that disconnects must not cancel the work other callers share
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            future.exception()
@@ -0,0 +1,105 @@
+import time
+import sqlite3
+import threading
+
+
+class SQLiteLRUStore:
+    """
+    One table in a SQLite file shared by every worker on the host and kept
+    across restarts. Each row records its size and when it was last read; the
+    least recently used rows are evicted once the table holds more than
+    `max_bytes`. Triggers keep the table's total size in a one-row side table,
+    so writes never have to re-sum the table.
+
+    Subclasses name the `table`, its `key_column` and the `columns` stored
+    alongside the key, and build their own get/put on `_get` and `_put`.
+    """
+
+    table = None
+    key_column = "key"
+    columns = ()
+
+    def __init__(self, path, max_bytes):
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = (f"{self.key_column} TEXT PRIMARY KEY", *self.columns, "size INTEGER NOT NULL", "accessed_at REAL NOT NULL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({', '.join(columns)})")
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at ON {self.table} (accessed_at)")
+        self._create_size_total()
+        self._lock = threading.Lock()
+
+    def _create_size_total(self):
+        table, total = self.table, f"{self.table}_size"
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {total} (total INTEGER NOT NULL)")
+            # Tables created before the total was tracked are summed once
+            self._conn.execute(
+                f"INSERT INTO {total} (total) SELECT (SELECT COALESCE(SUM(size), 0) FROM {table}) "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {total})"
+            )
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_size_insert AFTER INSERT ON {table} "
+                f"BEGIN UPDATE {total} SET total = total + NEW.size; END"
+            )
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_size_delete AFTER DELETE ON {table} "
+                f"BEGIN UPDATE {total} SET total = total - OLD.size; END"
+            )
+            self._conn.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_size_update AFTER UPDATE OF size ON {table} "
+                f"BEGIN UPDATE {total} SET total = total - OLD.size + NEW.size; END"
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _get(self, key, fields):
+        """The given fields of a row as a tuple, marking the row as just used, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(fields)} FROM {self.table} WHERE {self.key_column} = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    f"UPDATE {self.table} SET accessed_at = ? WHERE {self.key_column} = ?", (time.time(), key)
+                )
+        return row
+
+    def _put(self, key, size, **values):
+        """Insert or replace a row, then evict down to `max_bytes`."""
+        names = [self.key_column, *values, "size", "accessed_at"]
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete skips the size triggers
+        updates = ", ".join(f"{name} = excluded.{name}" for name in names[1:])
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO {self.table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT ({self.key_column}) DO UPDATE SET {updates}",
+                (key, *values.values(), size, time.time()),
+            )
+            self._evict()
+
+    def _update(self, key, **values):
+        assignments = ", ".join(f"{name} = ?" for name in values)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE {self.table} SET {assignments} WHERE {self.key_column} = ?", (*values.values(), key)
+            )
+
+    def _delete(self, keys):
+        """Remove rows by key. Called with the lock held."""
+        self._conn.executemany(f"DELETE FROM {self.table} WHERE {self.key_column} = ?", [(key,) for key in keys])
+
+    def _evict(self):
+        total = self._conn.execute(f"SELECT total FROM {self.table}_size").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        expired = []
+        for key, size in self._conn.execute(f"SELECT {self.key_column}, size FROM {self.table} ORDER BY accessed_at"):
+            if total <= self.max_bytes:
+                break
+            expired.append(key)
+            total -= size
+        self._delete(expired)
@@ -0,0 +1,57 @@
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .metrics import STAGE_DURATION
+
+# Recently finished spans, kept so one request's stages can be inspected together
+_finished_spans = deque(maxlen=10000)
+
+_current_span = ContextVar("current_span", default=None)
+
+
+def current_trace_id():
+    """Return the trace id of the active span, or None outside a trace."""
+    active = _current_span.get()
+    return active["trace_id"] if active else None
+
+
+@contextmanager
+def span(name, trace_id=None, **attributes):
+    """
+    Time a unit of work and record it in the `stage_duration_seconds` histogram.
+
+    The span becomes the parent of any span opened inside it, including in
+    tasks and `asyncio.to_thread` calls started from it, since both copy the
+    current contextvars. A new trace is started when there is no active span.
+    """
+    parent = _current_span.get()
+    record = {
+        "trace_id": trace_id or (parent["trace_id"] if parent else uuid.uuid4().hex),
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "attributes": attributes,
+        "start": time.time(),
+        "duration_ms": None,
+        "error": None,
+    }
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = repr(e)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_span.reset(token)
+        record["duration_ms"] = round(elapsed * 1000, 3)
+        STAGE_DURATION.observe(elapsed, stage=name)
+        _finished_spans.append(record)
+
+
+def get_trace(trace_id):
+    """Return the finished spans of a trace, in start order."""
+    return sorted((s for s in list(_finished_spans) if s["trace_id"] == trace_id), key=lambda s: s["start"])
@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from string import Template
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+DEFAULT_RESPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "default_responses.json")
+
+
+def parse_latency(spec):
+    """
+    Build a latency sampler (returning seconds) from a spec string:
+    "fixed:MS", "uniform:MIN_MS,MAX_MS" or "lognormal:MEDIAN_MS,SIGMA".
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        median_ms, sigma = values
+        return lambda: random.lognormvariate(0, sigma) * median_ms / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def load_rules(path):
+    """
+    Load response rules: a JSON list of {"name", "match", "response", "fence"}.
+    `match` is a regex searched in the prompt (the first matching rule wins),
+    `response` is text or a JSON value, and "$model" / "$prompt_chars" are
+    substituted. With "fence": true the response is wrapped in a ```json block.
+    """
+    with open(path, "rb") as file:
+        rules = orjson.loads(file.read())
+    for rule in rules:
+        rule["pattern"] = re.compile(rule.get("match", ""), re.IGNORECASE)
+        response = rule["response"]
+        text = response if isinstance(response, str) else orjson.dumps(response, option=orjson.OPT_INDENT_2).decode()
+        if rule.get("fence"):
+            text = f"```json\n{text}\n```"
+        rule["template"] = Template(text)
+    return rules
+
+
+def render_response(rules, prompt, model):
+    for rule in rules:
+        if rule["pattern"].search(prompt):
+            return rule["name"], rule["template"].safe_substitute(model=model, prompt_chars=len(prompt))
+    return "none", ""
+
+
+def _estimate_tokens(text):
+    # Roughly four characters per token
+    return max(1, len(text) // 4)
+
+
+def create_app(responses_path=DEFAULT_RESPONSES, latency="fixed:0"):
+    """
+    Local OpenAI-compatible stand-in for GitHub Models and Together.
+
+    Answers `POST /chat/completions` (and `/v1/chat/completions`) with canned
+    responses chosen by the rules in `responses_path`, after a latency drawn
+    from the `latency` distribution. Point the app at it with
+    LLM_BASE_URL_GITHUB / LLM_BASE_URL_TOGETHER.
+    """
+    rules = load_rules(responses_path)
+    sample_latency = parse_latency(latency)
+    app = FastAPI(default_response_class=ORJSONResponse)
+    app.state.calls = {}
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = orjson.loads(await request.body())
+        model = body.get("model", "stub")
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        rule_name, content = render_response(rules, prompt, model)
+        app.state.calls[rule_name] = app.state.calls.get(rule_name, 0) + 1
+        delay = sample_latency()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream(completion_id, created, model, content, delay), media_type="text/event-stream"
+            )
+
+        await asyncio.sleep(delay)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ],
+            "usage": {
+                "prompt_tokens": _estimate_tokens(prompt),
+                "completion_tokens": _estimate_tokens(content),
+                "total_tokens": _estimate_tokens(prompt) + _estimate_tokens(content),
+            },
+        }
+
+    @app.get("/stats")
+    async def stats():
+        """Number of calls answered by each rule."""
+        return app.state.calls
+
+    return app
+
+
+async def _stream(completion_id, created, model, content, delay, pieces=20):
+    """Send the content as SSE chunks spread evenly over the sampled latency."""
+    step = max(1, len(content) // pieces)
+    chunks = [content[i:i + step] for i in range(0, len(content), step)] or [""]
+    for text in chunks:
+        await asyncio.sleep(delay / len(chunks))
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}],
+        }
+        yield f"data: {orjson.dumps(chunk).decode()}\n\n"
+    done = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    yield f"data: {orjson.dumps(done).decode()}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the local stand-in LLM server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--responses", default=DEFAULT_RESPONSES, help="JSON file of response rules")
+    parser.add_argument(
+        "--latency",
+        default=os.getenv("STUB_LATENCY", "lognormal:800,0.5"),
+        help='Latency distribution: "fixed:MS", "uniform:MIN_MS,MAX_MS" or "lognormal:MEDIAN_MS,SIGMA"',
+    )
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.responses, args.latency), host=args.host, port=args.port)
@@ -0,0 +1,170 @@
+import time
+import base64
+import asyncio
+from core.tracing import span
+from core.json_repair import JSONRepairError, parse_json
+from requirement_analysis.main import extract_requirements
+from architecture_and_tech_stack.main import get_tech_stack_recommendation, generate_architecture_diagram
+from time_and_effort_estimation.main import build_effort_excel
+from business_analyst.main import get_user_persona, categorize_features
+from wireframe_generator.main import selenium_pipeline
+
+
+class StageSkipped(Exception):
+    """Raised for a stage whose dependency did not complete."""
+
+
+async def run_stages(stages, selected=None):
+    """
+    Run stages as a dependency DAG, starting every stage as soon as the
+    stages it depends on have finished.
+
+    Args:
+        stages (dict): Stage name -> (list of dependency names, coroutine function).
+            The function receives a dict of the results of its dependencies.
+        selected (list): Stage names to run. Their dependencies are always run.
+
+    Returns:
+        tuple: (results, errors, timings) dicts keyed by stage name.
+    """
+    needed = set()
+    pending = list(selected or stages)
+    while pending:
+        name = pending.pop()
+        if name not in stages:
+            raise ValueError(f"Unknown pipeline stage: {name}")
+        if name not in needed:
+            needed.add(name)
+            pending.extend(stages[name][0])
+
+    results, errors, timings = {}, {}, {}
+    tasks = {}
+    pipeline_start = time.perf_counter()
+
+    async def run(name):
+        deps, func = stages[name]
+        for dep in deps:
+            await asyncio.wait([tasks[dep]])
+        missing = [dep for dep in deps if dep not in results]
+        if missing:
+            raise StageSkipped(f"Skipped because {', '.join(missing)} did not complete.")
+
+        started = time.perf_counter()
+        try:
+            with span(f"pipeline.{name}"):
+                results[name] = await func({dep: results[dep] for dep in deps})
+        finally:
+            finished = time.perf_counter()
+            timings[name] = {
+                "start_ms": round((started - pipeline_start) * 1000, 1),
+                "duration_ms": round((finished - started) * 1000, 1),
+            }
+
+    # Only create tasks once every name is known, so deps can be looked up
+    for name in stages:
+        if name in needed:
+            tasks[name] = asyncio.ensure_future(run(name))
+
+    try:
+        for name, task in tasks.items():
+            try:
+                await task
+            except Exception as e:
+                errors[name] = str(e)
+    finally:
+        # Cancelled (e.g. the client disconnected): stop the stages still running
+        unfinished = [task for task in tasks.values() if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+
+    return results, errors, timings
+
+
+def _to_requirements(extraction, tech_stack_preference, platforms):
+    """Convert extraction output to the request shape used by the other endpoints."""
+    return {
+        "functionalRequirement": extraction.get("functional_requirements", []),
+        "nonFunctionalRequirement": extraction.get("non_functional_requirements", []),
+        "featureBreakdown": extraction.get("feature_breakdown", []),
+        "requirement_tech_stack": tech_stack_preference,
+        "requirement_platforms": platforms,
+    }
+
+
+def _load_json(value, stage):
+    if isinstance(value, (dict, list)):
+        return value
+    try:
+        return parse_json(value)
+    except JSONRepairError:
+        raise ValueError(f"{stage} did not return valid JSON.")
+
+
+def build_presales_stages(requirement_text, url, tech_stack, platforms, isMobileApp=False):
+    """
+    Define the presales stages. Everything depends on the extraction; only the
+    architecture diagram also waits for the tech stack recommendation.
+    """
+
+    async def extract(_):
+        extraction = await extract_requirements(requirement_text, url, tech_stack, platforms)
+        if extraction is None:
+            raise ValueError("Failed to download the requirement document.")
+        extraction = _load_json(extraction, "Extraction")
+        if "error" in extraction:
+            raise ValueError(extraction["error"])
+        return extraction
+
+    async def tech_stack_recommendation(deps):
+        requirements = _to_requirements(deps["extract"], tech_stack, platforms)
+        return _load_json(await get_tech_stack_recommendation(requirements, tech_stack), "Tech stack recommendation")
+
+    async def architecture_diagram(deps):
+        requirements = _to_requirements(deps["extract"], tech_stack, platforms)
+        return await generate_architecture_diagram(requirements, deps["tech_stack_recommendation"])
+
+    async def user_persona(deps):
+        return await get_user_persona(_to_requirements(deps["extract"], tech_stack, platforms))
+
+    async def categorized_features(deps):
+        return await categorize_features(_to_requirements(deps["extract"], tech_stack, platforms))
+
+    async def estimate(deps):
+        excel_data = await build_effort_excel(_to_requirements(deps["extract"], tech_stack, platforms))
+        if excel_data is None:
+            raise ValueError("No valid effort estimation data available.")
+        return {"filename": "effort_estimation.xlsx", "content_base64": base64.b64encode(excel_data).decode("ascii")}
+
+    async def wireframe(deps):
+        return await selenium_pipeline(deps["extract"].get("feature_breakdown", []), isMobileApp)
+
+    return {
+        "extract": ([], extract),
+        "tech_stack_recommendation": (["extract"], tech_stack_recommendation),
+        "architecture_diagram": (["extract", "tech_stack_recommendation"], architecture_diagram),
+        "user_persona": (["extract"], user_persona),
+        "categorized_features": (["extract"], categorized_features),
+        "estimate": (["extract"], estimate),
+        "wireframe": (["extract"], wireframe),
+    }
+
+
+async def run_presales_pipeline(requirement_text, url, tech_stack, platforms, isMobileApp=False, stages=None):
+    """
+    Run the whole presales flow for one document.
+
+    Returns:
+        dict: Per-stage results, errors and timings, plus the total wall-clock time.
+    """
+    started = time.perf_counter()
+    results, errors, timings = await run_stages(
+        build_presales_stages(requirement_text, url, tech_stack, platforms, isMobileApp),
+        stages,
+    )
+    return {
+        "data": results,
+        "errors": errors,
+        "timings": timings,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
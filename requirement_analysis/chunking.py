@@ -0,0 +1,236 @@
+import re
+import copy
+import hashlib
+from core.prompts import count_tokens
+
+# Pages of extracted PDF text are separated by form feeds
+PAGE_BREAK = "\f"
+# Running headers and footers are looked for among this many lines at the top and bottom of each page
+RUNNING_EDGE_LINES = 2
+
+_SECTION_NUMBER = re.compile(r"^\s*(\d+\.)*\d+\.?\s+")
+_HEADING = re.compile(
+    r"^\s*("
+    r"#{1,6}\s+\S.*"                               # Markdown heading
+    r"|(\d+\.)*\d+\.?\s+[A-Z][^.!?]{0,80}"         # Numbered heading, e.g. "3.2 Functional Requirements"
+    r"|[A-Z][A-Z0-9 &/,()\-]{2,80}"                # ALL CAPS heading
+    r")\s*$"
+)
+
+
+def _pages(text, page_offsets=None):
+    """Split text into pages, at known page start offsets or else at form feeds."""
+    if not page_offsets:
+        return text.split(PAGE_BREAK)
+    bounds = [0, *page_offsets, len(text)]
+    return [text[start:end].strip(PAGE_BREAK) for start, end in zip(bounds, bounds[1:])]
+
+
+def _sections(text, page_offsets=None):
+    """Split text into sections starting at each page break or heading line."""
+    sections = []
+    for page in _pages(text, page_offsets):
+        current = []
+        for line in page.split("\n"):
+            if _HEADING.match(line) and current:
+                sections.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            sections.append("\n".join(current))
+    return [section for section in sections if section.strip()]
+
+
+def _split_oversized(section, max_tokens, separators=("\n\n", "\n")):
+    """Split a section that alone exceeds the budget along paragraphs, then lines."""
+    for index, separator in enumerate(separators):
+        parts = section.split(separator)
+        if len(parts) > 1:
+            pieces = []
+            for part in parts:
+                if count_tokens(part) <= max_tokens:
+                    pieces.append(part)
+                else:
+                    pieces.extend(_split_oversized(part, max_tokens, separators[index + 1:]))
+            return pieces
+    # A single huge line: cut by characters, about four per token
+    width = max_tokens * 4
+    return [section[i:i + width] for i in range(0, len(section), width)]
+
+
+def split_document(text, max_tokens, page_offsets=None):
+    """
+    Split a requirements document into chunks of at most ~`max_tokens`,
+    cutting only at headings and page boundaries where possible. Returns a
+    single chunk when the document already fits. `page_offsets` are the page
+    (or DOCX section) start offsets recorded at extraction.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    pieces = []
+    for section in _sections(text, page_offsets):
+        if count_tokens(section) > max_tokens:
+            pieces.extend(_split_oversized(section, max_tokens))
+        else:
+            pieces.append(section)
+
+    chunks, current, size = [], [], 0
+    for piece in pieces:
+        piece_size = count_tokens(piece)
+        if current and size + piece_size > max_tokens:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += piece_size
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _shape(line):
+    return re.sub(r"\d+", "#", line.strip())
+
+
+def _page_edges(lines):
+    """Indexes of the lines near the top and bottom of a page, or none for pages too short to carry headers."""
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    if len(filled) <= 2 * RUNNING_EDGE_LINES:
+        return set()
+    return set(filled[:RUNNING_EDGE_LINES] + filled[-RUNNING_EDGE_LINES:])
+
+
+def _running_lines(pages):
+    """
+    For each page (a list of lines), the indexes of its running header and
+    footer lines: lines near the top or bottom of the page that recur there
+    on at least half of the pages, identical except for at most one number
+    (the page number).
+    """
+    edges = [_page_edges(lines) for lines in pages]
+    if len(pages) < 3:
+        return [set() for _ in pages]
+    occurrences = {}
+    for lines, edge in zip(pages, edges):
+        for shape, numbers in {_shape(lines[index]): tuple(re.findall(r"\d+", lines[index])) for index in edge}.items():
+            occurrences.setdefault(shape, []).append(numbers)
+    running = {
+        shape for shape, numbers in occurrences.items()
+        if len(numbers) >= len(pages) / 2 and sum(len(set(column)) > 1 for column in zip(*numbers)) <= 1
+    }
+    return [{index for index in edge if _shape(lines[index]) in running} for lines, edge in zip(pages, edges)]
+
+
+def _section_key(section):
+    # Heading numbers are ignored: inserting a section renumbers all that follow
+    return _key(_SECTION_NUMBER.sub("", section, count=1))
+
+
+def document_sections(text):
+    """
+    Sections of a document as (key, text) pairs, cut at headings only, since
+    page breaks shift whenever text is added. The text is the section as it
+    appears in the document. The key is a hash of that text without running
+    headers and footers, and with case, punctuation, spacing and heading
+    numbers ignored, so an unchanged section keeps its key across revisions.
+    """
+    pages = [page.split("\n") for page in text.split(PAGE_BREAK)]
+    sections, lines, key_lines = [], [], []
+    for page, running in zip(pages, _running_lines(pages)):
+        for index, line in enumerate(page):
+            # A running header is never taken for a heading, nor makes a section of its own
+            if index not in running and _HEADING.match(line) and key_lines:
+                sections.append((lines, key_lines))
+                lines, key_lines = [], []
+            lines.append(line)
+            if index not in running:
+                key_lines.append(line)
+    sections.append((lines, key_lines))
+
+    keyed = []
+    for lines, key_lines in sections:
+        section = "\n".join(lines)
+        if not section.strip():
+            continue
+        key_text = "\n".join(key_lines) if any(line.strip() for line in key_lines) else section
+        keyed.append((hashlib.blake2b(_section_key(key_text).encode(), digest_size=8).hexdigest(), section))
+    return keyed
+
+
+def section_batches(sections, max_tokens):
+    """
+    Pack consecutive (key, text) sections into batches of at most
+    ~`max_tokens`. A section that alone exceeds the budget is split into
+    pieces that keep its key.
+
+    Returns:
+        list: batches, each a list of (key, text) pieces.
+    """
+    batches, batch, size = [], [], 0
+    for key, section in sections:
+        pieces = _split_oversized(section, max_tokens) if count_tokens(section) > max_tokens else [section]
+        for piece in pieces:
+            piece_size = count_tokens(piece)
+            if batch and size + piece_size > max_tokens:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append((key, piece))
+            size += piece_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _key(text):
+    """Normalized form used to spot duplicates: case, punctuation and spacing ignored."""
+    return re.sub(r"\W+", " ", str(text)).strip().lower()
+
+
+def _merge_named(existing, items, name_field, merge_item):
+    """Merge dicts identified by `name_field` into `existing` (a key -> item dict), keeping first-seen order."""
+    for item in items:
+        key = _key(item.get(name_field, ""))
+        if key in existing:
+            merge_item(existing[key], item)
+        else:
+            existing[key] = dict(item)
+
+
+def _merge_feature(target, feature):
+    if len(feature.get("description", "")) > len(target.get("description", "")):
+        target["description"] = feature["description"]
+    subfeatures = {_key(subfeature.get("name", "")): subfeature for subfeature in target.get("subfeatures", [])}
+    _merge_named(subfeatures, feature.get("subfeatures", []), "name", lambda existing, new: None)
+    target["subfeatures"] = list(subfeatures.values())
+
+
+def _merge_module(target, module):
+    features = {_key(feature.get("name", "")): feature for feature in target.get("features", [])}
+    _merge_named(features, module.get("features", []), "name", _merge_feature)
+    target["features"] = list(features.values())
+
+
+def merge_extractions(results):
+    """
+    Combine per-chunk extraction results in document order. Requirements are
+    deduplicated; modules, features and subfeatures with the same name are
+    merged, keeping the longest description.
+    """
+    results = copy.deepcopy(results)
+    merged = {"functional_requirements": [], "non_functional_requirements": [], "feature_breakdown": []}
+    for field in ("functional_requirements", "non_functional_requirements"):
+        seen = set()
+        for result in results:
+            for requirement in result.get(field, []):
+                key = _key(requirement)
+                if key and key not in seen:
+                    seen.add(key)
+                    merged[field].append(requirement)
+
+    modules = {}
+    for result in results:
+        _merge_named(modules, result.get("feature_breakdown", []), "module", _merge_module)
+    for module in modules.values():
+        module["features"] = [dict(feature, subfeatures=feature.get("subfeatures", [])) for feature in module.get("features", [])]
+    merged["feature_breakdown"] = list(modules.values())
+    return merged
@@ -1,25 +1,206 @@
-import pymupdf as fitz  # For PDFs
-from docx import Document  # For DOCX
+import io
+import os
+import re
+import threading
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from a PDF file and return it as a string."""
+# pymupdf and python-docx are imported on first use to keep app startup fast
+
+# PDFs with at least this many pages are extracted across a process pool
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+# One process pool per app worker, so keep it small by default
+PDF_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+# Bump when extraction or normalization changes, so cached text is re-extracted
+EXTRACTOR_VERSION = 2
+
+_TRAILING_SPACE = re.compile(r"[ \t\r]+\n")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+_pool = None
+# Extraction runs in to_thread workers, so two large PDFs can ask for the pool at once
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """The PDF worker pool, started on the first PDF large enough to need it."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawn: forking a server process with live threads is not safe
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    """Stop the PDF worker processes, if any were started. Called from the app shutdown hook."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def _read_bytes(source):
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    with open(source, "rb") as file:
+        return file.read()
+
+
+def _extract_page_range(pdf_bytes, start, stop):
+    """Worker process entry point: text of pages [start, stop)."""
+    import pymupdf as fitz
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        return [doc[number].get_text("text") for number in range(start, stop)]
+
+
+def iter_pdf_pages(pdf_source):
+    """
+    Yield the text of each page of a PDF (file path or bytes), in order.
+    Large PDFs are split into page ranges extracted in parallel worker
+    processes; pages are yielded as soon as their range is done.
+    """
+    import pymupdf as fitz  # For PDFs
+
+    pdf_bytes = _read_bytes(pdf_source)
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        page_count = doc.page_count
+        if page_count < PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+            for page in doc:
+                yield page.get_text("text")
+            return
+
+    # Twice as many ranges as workers evens out pages of uneven cost
+    ranges = min(page_count, PDF_WORKERS * 2)
+    bounds = [page_count * index // ranges for index in range(ranges + 1)]
+    pool = _get_pool()
+    futures = [pool.submit(_extract_page_range, pdf_bytes, start, stop) for start, stop in zip(bounds, bounds[1:])]
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page in doc:
-            text += page.get_text("text") + "\n"
-        return text.strip()
-    except Exception as e:
-        print(f"Error reading PDF: {e}")
-        return None
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
 
-def extract_text_from_doc(doc_path):
-    """Extract text from a DOCX file and return it as a string."""
+def normalize_text(text):
+    """Unify line endings, drop trailing spaces and collapse runs of blank lines."""
+    # Form feeds are reserved as page separators
+    text = text.replace("\r\n", "\n").replace("\f", "\n").replace("\x00", "")
+    text = _TRAILING_SPACE.sub("\n", text + "\n")
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def join_parts(parts, separator):
+    """
+    Normalize and join pages (or sections), skipping empty ones.
+
+    Returns:
+        tuple: (text, offsets) where offsets[i] is where part i starts in text.
+    """
+    pieces, offsets, position = [], [], 0
+    for part in parts:
+        part = normalize_text(part)
+        if not part:
+            continue
+        if pieces:
+            position += len(separator)
+        offsets.append(position)
+        pieces.append(part)
+        position += len(part)
+    return separator.join(pieces), offsets
+
+
+def extract_document(source, file_type):
+    """
+    Extract normalized text from PDF or DOCX bytes (or a file path).
+
+    Returns:
+        tuple: (text, offsets) with the start offset of every page (PDF) or
+        heading section (DOCX), or (None, []) if the document can't be read.
+    """
     try:
-        doc = Document(doc_path)
-        text = "\n".join([para.text for para in doc.paragraphs])
-        return text.strip()
+        if file_type == "pdf":
+            # Pages are separated by form feeds so large documents can be chunked at page boundaries
+            return join_parts(iter_pdf_pages(source), "\f")
+        return join_parts(iter_docx_sections(source), "\n")
     except Exception as e:
-        print(f"Error reading DOCX: {e}")
-        return None
+        print(f"Error reading {file_type.upper()}: {e}")
+        return None, []
+
+
+def extract_text_from_pdf(pdf_source):
+    """Extract text from a PDF file path or in-memory PDF bytes and return it as a string."""
+    return extract_document(pdf_source, "pdf")[0]
+
+
+def _table_text(table):
+    """One line per row, cells separated by " | ". Merged cells repeat in python-docx, so repeats are dropped."""
+    lines = []
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            text = cell.text.strip()
+            if text and (not cells or cells[-1] != text):
+                cells.append(text)
+        if cells:
+            lines.append(" | ".join(cells))
+    return "\n".join(lines)
+
+
+def _header_footer_text(doc, attribute):
+    """Unique header (or footer) paragraphs across all sections."""
+    seen = []
+    for section in doc.sections:
+        for paragraph in getattr(section, attribute).paragraphs:
+            text = paragraph.text.strip()
+            if text and text not in seen:
+                seen.append(text)
+    return "\n".join(seen)
+
+
+def iter_docx_sections(doc_source):
+    """
+    Yield the text of a DOCX (file path or bytes) one section at a time, a
+    section starting at each Heading-styled paragraph. Paragraphs and tables
+    are kept in document order; page headers come first and footers last.
+    """
+    from docx import Document  # For DOCX
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    if isinstance(doc_source, (bytes, bytearray)):
+        doc_source = io.BytesIO(doc_source)
+    doc = Document(doc_source)
+
+    header = _header_footer_text(doc, "header")
+    if header:
+        yield header
+
+    blocks = []
+    for element in doc.element.body.iterchildren():
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            paragraph = Paragraph(element, doc)
+            style = paragraph.style.name if paragraph.style is not None else ""
+            if style.startswith("Heading") and blocks:
+                yield "\n".join(blocks)
+                blocks = []
+            blocks.append(paragraph.text)
+        elif tag == "tbl":
+            blocks.append(_table_text(Table(element, doc)))
+    if blocks:
+        yield "\n".join(blocks)
+
+    footer = _header_footer_text(doc, "footer")
+    if footer:
+        yield footer
+
 
+def extract_text_from_doc(doc_source):
+    """Extract text, including tables, from a DOCX file path or in-memory DOCX bytes and return it as a string."""
+    return extract_document(doc_source, "docx")[0]
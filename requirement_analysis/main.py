@@ -1,46 +1,100 @@
-import json
-import time
-import re
-from dotenv import load_dotenv
-# from together import Together
-from openai import OpenAI
 import os
-import requests
-from .extract_from_doc import extract_text_from_doc, extract_text_from_pdf
+import asyncio
+from core.llm_client import hedged_completion
+from core.json_repair import JSONRepairError, is_json, parse_json, validate
+from core.metrics import INCREMENTAL_EXTRACTIONS, PARSE_FAILURES
+from core.tracing import span
+from core.prompts import count_tokens
+from core.llm_cache import is_bypassed
+from core.downloads import DownloadError, download
+from .extract_from_doc import extract_document
+from .chunking import document_sections, merge_extractions, section_batches, split_document
+from .near_duplicates import NEAR_DUPLICATE_HITS, context_key, get_index
+from .text_cache import TEXT_CACHE_HITS, TEXT_CACHE_MISSES, get_text_cache, text_cache_key
 
-# Load API key from .env file
-load_dotenv()
-# api_key = os.getenv("TOGETHER_API_KEY")
-
-# Initialize Together client
-# client = Together(api_key=api_key)
-client = OpenAI(
-    base_url="https://models.inference.ai.azure.com",
-    api_key=os.environ["GITHUB_TOKEN"],
-)
+# Shape of the extraction output; missing lists are filled in as empty
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "required": ["functional_requirements"],
+    "properties": {
+        "functional_requirements": {"type": "array", "default": []},
+        "non_functional_requirements": {"type": "array", "default": []},
+        "feature_breakdown": {
+            "type": "array",
+            "default": [],
+            "items": {
+                "type": "object",
+                "required": ["module"],
+                "properties": {
+                    "features": {
+                        "type": "array",
+                        "default": [],
+                        "items": {
+                            "type": "object",
+                            "required": ["name"],
+                            "properties": {"subfeatures": {"type": "array", "default": []}},
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
 
 def extract_json_from_text(text):
-    """Extracts and validates the JSON part from a given text output."""
+    """Extracts, repairs and validates the JSON part of a model output and returns it as a dict."""
+    return parse_json(text, EXTRACTION_SCHEMA)
+
+def is_valid_extraction(text):
+    """True when a valid extraction can be recovered from the model output, i.e. it is worth caching."""
+    return is_json(text, EXTRACTION_SCHEMA)
+
+async def _download_document(url):
+    """Download the document bytes through the shared connection pool and local content store."""
     try:
-        match = re.search(r"\{.*\}", text, re.DOTALL)
-        if match:
-            json_text = match.group(0)  # Extract matched JSON part
-            parsed_json = json.loads(json_text)  # Validate JSON structure
-
-            # Ensure every feature has 'subfeatures' explicitly set
-            for module in parsed_json.get("feature_breakdown", []):
-                for feature in module.get("features", []):
-                    if "subfeatures" not in feature:
-                        feature["subfeatures"] = []  # Ensure empty list if missing
-
-            return json.dumps(parsed_json, indent=4)  # Return formatted JSON
-        else:
-            raise ValueError("No valid JSON found in the text.")
-    except json.JSONDecodeError:
-        raise ValueError("Extracted text is not valid JSON.")
-
-def extract_requirements(requirement_text: str, url: str, tech_stack, platforms):
-    """Extract requirements from a given requirement text and a Cloudinary PDF/DOCX URL."""
+        return await download(url)
+    except DownloadError as e:
+        print(f"Error downloading file: {e}")
+        return None
+
+def _extract_document_text(content, file_type):
+    """
+    Extract text and page offsets straight from the downloaded bytes, reusing
+    the result for bytes parsed before. Runs in a worker thread.
+    """
+    cache = get_text_cache()
+    if cache is None:
+        return extract_document(content, file_type)
+    key = text_cache_key(content, file_type)
+    cached = cache.get(key)
+    if cached is not None:
+        TEXT_CACHE_HITS.inc()
+        return cached
+    TEXT_CACHE_MISSES.inc()
+    text, offsets = extract_document(content, file_type)
+    if text:
+        cache.put(key, text, offsets)
+    return text, offsets
+
+def request_context(requirement_text: str, tech_stack, platforms):
+    """
+    The request inputs that surround the document text in every extraction
+    prompt, as (prefix, suffix).
+    """
+    tech_stack = tech_stack if tech_stack else "No preference"
+    platforms = platforms if platforms else "Any"
+    prefix = requirement_text + "\n\n"
+    suffix = "\n\n" + "Tech Stack preferences are: " + tech_stack + "\n\n" + "Platforms required: " + platforms
+    return prefix, suffix
+
+async def prepare_document(url: str):
+    """
+    Download the document and extract its text.
+
+    Returns:
+        tuple: (document text, page offsets within it). The text is None if
+        the download failed, or an error dict if no text could be extracted.
+    """
 
     if url.endswith(".pdf"):
         file_type = "pdf"
@@ -48,131 +102,351 @@ def extract_requirements(requirement_text: str, url: str, tech_stack, platforms)
         file_type = "docx"
     else:
         raise ValueError("Unsupported file format. Only PDF and DOCX are supported.")
-    
-    tech_stack = tech_stack if tech_stack else "No preference"
-    platforms = platforms if platforms else "Any"
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading file: {e}")
+    with span("extract.download", url=url):
+        content = await _download_document(url)
+    if content is None:
+        return None, []
+
+    # Blocking parsing stays off the event loop
+    with span("extract.parse_document", file_type=file_type):
+        extracted_text, offsets = await asyncio.to_thread(_extract_document_text, content, file_type)
+
+    if not extracted_text:
+        return {"error": "Failed to extract text from the document"}, []
+    return extracted_text, offsets
+
+async def extract_requirements(requirement_text: str, url: str, tech_stack, platforms, previous_url=None):
+    """
+    Extract requirements from a given requirement text and a Cloudinary PDF/DOCX URL.
+
+    With `previous_url` (an earlier version of the same RFP, extracted with
+    the same inputs), or when the document is a near-duplicate of one
+    already extracted, only the sections that changed since that version
+    are sent to the model.
+    """
+
+    document_text, page_offsets = await prepare_document(url)
+    if not isinstance(document_text, str):
+        return document_text
+    request = request_context(requirement_text, tech_stack, platforms)
+
+    index = get_index()
+    if index is None:
+        return await extract_requirements_llm(document_text, page_offsets=page_offsets, context=request)
+
+    context = context_key(requirement_text, tech_stack, platforms)
+    previous = None
+    if not is_bypassed():
+        if previous_url:
+            previous = await _find_previous_version(index, previous_url, context)
+        if previous is None:
+            # Revised RFPs that barely changed are extracted incrementally from the earlier version
+            with span("extract.near_duplicate_lookup"):
+                previous = await asyncio.to_thread(index.find, document_text, context)
+            if previous is not None:
+                print(f"Near-duplicate of stored document {previous['id']} (similarity {previous['similarity']:.2f}), reusing its unchanged parts")
+                NEAR_DUPLICATE_HITS.inc()
+
+    previous_parts = previous["parts"] if previous else []
+    result, parts = await extract_sections(document_text, request, previous_parts)
+    # An unchanged document is already stored
+    if parts and parts != previous_parts:
+        await asyncio.to_thread(index.add, document_text, context, parts)
+    return result
+
+async def _find_previous_version(index, previous_url, context):
+    """The stored extraction of the previous version of a document, or None."""
+    previous_text, _ = await prepare_document(previous_url)
+    if not isinstance(previous_text, str):
         return None
+    with span("extract.previous_version_lookup"):
+        previous = await asyncio.to_thread(index.find, previous_text, context)
+    if previous is None:
+        print("⚠️ No stored extraction for the previous version, extracting the full document")
+    return previous
 
-    file_path = f"temp.{file_type}"
-    with open(file_path, "wb") as f:
-        f.write(response.content)
+# Revisions where more than this share of sections must be re-extracted are extracted in full
+REVISION_MAX_CHANGED = float(os.getenv("REVISION_MAX_CHANGED", "0.5"))
+# Indexed documents send about this many tokens of sections per request. Every
+# section gets a result of its own, so the batch is kept smaller than a plain
+# chunk to leave room in the output limit for the repeated modules
+SECTION_BATCH_TOKENS = int(os.getenv("SECTION_BATCH_TOKENS", "3000"))
 
-    extracted_text = extract_text_from_pdf(file_path) if file_type == "pdf" else extract_text_from_doc(file_path)
+# Output of a sectioned request: one extraction per section number
+SECTIONED_SCHEMA = {
+    "type": "object",
+    "required": ["sections"],
+    "properties": {"sections": {"type": "object"}},
+}
 
-    if not extracted_text:
-        return {"error": "Failed to extract text from the document"}
-
-    # Append requirement_text to extracted document text
-    combined_text = requirement_text + "\n\n" + extracted_text + "\n\n" + "Tech Stack preferences are: " + tech_stack + "\n\n" + "Platforms required: " + platforms
-
-    return extract_requirements_llm(combined_text)
-
-def extract_requirements_llm(text, max_retries=3, delay=2):
-    """Extract functional and non-functional requirements from software requirements text with retry logic."""
-
-    attempt = 0
-    while attempt < max_retries:
-        prompt = f"""
-        Extract the following from the given software requirements document:
-
-        1. **Functional Requirements**: Clearly list all functional aspects.
-        2. **Non-Functional Requirements**: List performance, security, and other system constraints.
-        3. **Feature Breakdown**: Break down features into components, descriptions, and intelligently inferred subfeatures.
-
-        **Ensure the output strictly follows this JSON format:**  
-
-        {{
-            "functional_requirements": ["Requirement 1", "Requirement 2", ...],
-            "non_functional_requirements": ["Requirement 1", "Requirement 2", ...],
-            "feature_breakdown": [
-                {{
-                    "module": "Module Name",
-                    "features": [
-                        {{
-                            "name": "Feature Name",
-                            "description": "Brief explanation of what this feature does and why it is necessary.",
-                            "subfeatures": [
-                                {{
-                                    "name": "Subfeature Name",
-                                    "description": "Detailed description of what this subfeature does."
-                                }}
-                            ] or []
-                        }}
-                    ]
-                }}
-            ]
-        }}
-
-        **Important:**  
-        - Every **feature must contain the `subfeatures` key**.  
-        - If a feature has no explicitly mentioned subfeatures, **intelligently infer at least three subfeatures** by analyzing the feature's purpose and breaking it into smaller functional elements.  
-        - Subfeatures should capture granular tasks, interactions, or technical aspects relevant to the feature.  
-
-        **Example:**  
-        If the feature is **"User Authentication"**, possible subfeatures could be:  
-        1. "Password Reset" – Allows users to securely reset their password via email.  
-        2. "Multi-Factor Authentication" – Adds an extra security layer using OTP or an authenticator app.  
-        3. "Session Management" – Handles login session expiration and token refresh.  
-
-        Input Text:
-        {text}
-
-        Provide the output in valid JSON format only, without any additional text.
-        """
-
-
-        # response = client.chat.completions.create(
-        #     model="mistralai/Mistral-7B-Instruct-v0.3",
-        #     messages=[{"role": "user", "content": prompt}],
-        #     max_tokens=2500,
-        #     temperature=0.77,
-        #     top_p=0.7,
-        #     top_k=50,
-        #     repetition_penalty=1,
-        #     stop=["</s>"],
-        # )
-
-        response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt,
-                }
-            ],
-            model="gpt-4o",
-            max_tokens=4096,
-            temperature=0.77,
-            top_p=0.7,
-            frequency_penalty=0,
-            presence_penalty=0,
-            stop=["</s>"]
-        )
-
-        raw_output = response.choices[0].message.content
+async def extract_sections(text, context, previous_parts=(), max_retries=3):
+    """
+    Extract a document section by section (cut at headings), reusing the
+    results of an earlier version for the sections that did not change.
+
+    Sections are sent in batches, but the model returns a separate result for
+    each one, and every result is kept as a part: the section's key and its
+    result. Parts from `previous_parts` are kept for sections still in the
+    document. Parts of changed or deleted sections are dropped with
+    everything extracted from them, so nothing stale is left behind. Only new
+    and changed sections are sent to the model, with the request `context`,
+    and all parts are merged in document order. Sections the model left out
+    are extracted again the plain way; that result is used but not stored.
+
+    Returns:
+        tuple: (result, parts). The result is the raw model output when
+        nothing could be parsed, in which case parts is empty.
+    """
+    sections = document_sections(text)
+    if not sections:
+        return await extract_requirements_llm(text, max_retries, context=context), []
+    present = {key for key, _ in sections}
+    reused = [part for part in previous_parts if all(key in present for key in part["keys"])]
+    covered = {key for part in reused for key in part["keys"]}
+    pending = [(key, section) for key, section in sections if key not in covered]
+    if reused and len(pending) > REVISION_MAX_CHANGED * len(sections):
+        print(f"{len(pending)} of {len(sections)} sections changed, extracting the full document")
+        reused, pending = [], sections
+    elif previous_parts:
+        print(f"Re-extracting {len(pending)} of {len(sections)} sections, reusing the rest")
+    if reused:
+        INCREMENTAL_EXTRACTIONS.inc()
+
+    batches = section_batches(pending, min(SECTION_BATCH_TOKENS, chunk_budget(context)))
+    with span("extract.sections", batches=len(batches), sections=len(pending), reused=len(reused)):
+        results = await asyncio.gather(*(_extract_section_batch(batch, context, max_retries) for batch in batches))
+    pieces, failed = {}, set()
+    for batch, batch_results in zip(batches, results):
+        for (key, _), result in zip(batch, batch_results):
+            if result is None:
+                failed.add(key)
+            else:
+                pieces.setdefault(key, []).append(result)
+    # A section split into pieces only counts as extracted when every piece is
+    parsed = [
+        {"keys": [key], "result": found[0] if len(found) == 1 else merge_extractions(found)}
+        for key, found in pieces.items() if key not in failed
+    ]
 
+    unstored = []
+    if failed:
+        print(f"⚠️ {len(failed)} of {len(pending)} sections were missing from the model output, extracting them again")
+        retry_text = "\n".join(section for key, section in pending if key in failed)
+        retried = await extract_requirements_llm(retry_text, max_retries, context=context)
+        if isinstance(retried, dict):
+            unstored.append({"keys": sorted(failed), "result": retried})
+        elif not reused and not parsed:
+            return retried, []
+
+    position = {}
+    for index, (key, _) in enumerate(sections):
+        position.setdefault(key, index)
+    order = lambda part: min(position[key] for key in part["keys"])
+    parts = sorted(reused + parsed, key=order)
+    merged = sorted(parts + unstored, key=order)
+    if len(merged) == 1:
+        return merged[0]["result"], parts
+    return merge_extractions([part["result"] for part in merged]), parts
+
+def _numbered_sections(batch):
+    return "\n\n".join(f"[[Section {number}]]\n{section}" for number, (_, section) in enumerate(batch, 1))
+
+def _parse_sections(text):
+    return parse_json(text, SECTIONED_SCHEMA)["sections"]
+
+def is_valid_section_extraction(text):
+    return is_json(text, SECTIONED_SCHEMA)
+
+async def _extract_section_batch(batch, context, max_retries):
+    """
+    Extract a batch of sections in one request, with a separate result for
+    each. Returns one result per section, None for any the model left out or
+    got wrong.
+    """
+    prefix, suffix = context
+    response = await hedged_completion(
+        "github",
+        messages=[{"role": "user", "content": build_extraction_prompt(prefix + _numbered_sections(batch) + suffix, sectioned=True)}],
+        cache_check=is_valid_section_extraction,
+        name="extract",
+        max_extra=max_retries - 1,
+        **EXTRACTION_SETTINGS
+    )
+    try:
+        sections = _parse_sections(response.choices[0].message.content)
+    except JSONRepairError as e:
+        print(f"Sectioned extraction failed to parse: {e}")
+        PARSE_FAILURES.inc(parser="extract_sections")
+        return [None] * len(batch)
+
+    results = []
+    for number in range(1, len(batch) + 1):
         try:
-            # Extract only the valid JSON part and enforce structure
-            clean_json = extract_json_from_text(raw_output)
-            return clean_json
+            results.append(validate(sections[str(number)], EXTRACTION_SCHEMA))
+        except (KeyError, ValueError):
+            results.append(None)
+    return results
+
+# Inputs above this many tokens are extracted in chunks, so the 4096 token
+# output limit applies per chunk rather than to the whole document
+EXTRACTION_CHUNK_TOKENS = int(os.getenv("EXTRACTION_CHUNK_TOKENS", "6000"))
+# Document text per chunk never drops below this, however long the request inputs are
+MIN_CHUNK_TOKENS = 1000
+
+# Sampling settings shared by the blocking and streaming extraction calls
+EXTRACTION_SETTINGS = {
+    "model": "gpt-4o",
+    "max_tokens": 4096,
+    "temperature": 0.77,
+    "top_p": 0.7,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "stop": ["</s>"],
+}
+
+# Replaces the output format line of the prompt when sections are extracted separately
+SECTIONED_FORMAT = """**The input text is split into sections, each starting with a `[[Section N]]` line. Extract every section on its own, from that section's text only, and return one result per section keyed by its number: {"sections": {"1": <result>, "2": <result>, ...}}, where every result strictly follows this JSON format:**"""
+
+def build_extraction_prompt(text, sectioned=False):
+    """
+    Build the requirement extraction prompt for the given input text. With
+    `sectioned`, the text holds numbered sections (see `_numbered_sections`)
+    and one result is asked for per section.
+    """
+    output_format = SECTIONED_FORMAT if sectioned else "**Ensure the output strictly follows this JSON format:**  "
+    return f"""
+    Extract the following from the given software requirements document:
+
+    1. **Functional Requirements**: Clearly list all functional aspects.
+    2. **Non-Functional Requirements**: List performance, security, and other system constraints.
+    3. **Feature Breakdown**: Break down features into components, descriptions, and intelligently inferred subfeatures.
+
+    {output_format}
+
+    {{
+        "functional_requirements": ["Requirement 1", "Requirement 2", ...],
+        "non_functional_requirements": ["Requirement 1", "Requirement 2", ...],
+        "feature_breakdown": [
+            {{
+                "module": "Module Name",
+                "features": [
+                    {{
+                        "name": "Feature Name",
+                        "description": "Brief explanation of what this feature does and why it is necessary.",
+                        "subfeatures": [
+                            {{
+                                "name": "Subfeature Name",
+                                "description": "Detailed description of what this subfeature does."
+                            }}
+                        ] or []
+                    }}
+                ]
+            }}
+        ]
+    }}
+
+    **Important:**  
+    - Every **feature must contain the `subfeatures` key**.  
+    - If a feature has no explicitly mentioned subfeatures, **intelligently infer at least three subfeatures** by analyzing the feature's purpose and breaking it into smaller functional elements.  
+    - Subfeatures should capture granular tasks, interactions, or technical aspects relevant to the feature.  
 
-        except ValueError as e:
-            print(f"Attempt {attempt + 1} failed: {e}. Retrying...")
-            attempt += 1
-            time.sleep(delay)
+    **Example:**  
+    If the feature is **"User Authentication"**, possible subfeatures could be:  
+    1. "Password Reset" – Allows users to securely reset their password via email.  
+    2. "Multi-Factor Authentication" – Adds an extra security layer using OTP or an authenticator app.  
+    3. "Session Management" – Handles login session expiration and token refresh.  
+
+    Input Text:
+    {text}
+
+    Provide the output in valid JSON format only, without any additional text.
+    """
+
+async def extract_requirements_llm(text, max_retries=3, page_offsets=None, context=("", "")):
+    """
+    Extract functional and non-functional requirements from software requirements text.
+    Malformed output is repaired locally; the model is only asked again when
+    nothing valid can be recovered.
+
+    `context` is the (prefix, suffix) from `request_context`. Documents whose
+    prompt would exceed EXTRACTION_CHUNK_TOKENS are split at headings and
+    page boundaries, and every chunk is wrapped in the full context, so each
+    one still sees the requirement text, tech stack and platforms. The chunks
+    are extracted concurrently and merged. `page_offsets` (from the document
+    extraction) saves rescanning for pages.
+    """
+    prefix, suffix = context
+    chunks = split_document(text, chunk_budget(context), page_offsets)
+    if len(chunks) == 1:
+        return await _extract_chunk(prefix + text + suffix, max_retries)
+
+    print(f"Extracting requirements from {len(chunks)} chunks concurrently")
+    with span("extract.chunked", chunks=len(chunks)):
+        results = await asyncio.gather(*(_extract_chunk(prefix + chunk + suffix, max_retries) for chunk in chunks))
+    parsed = [result for result in results if isinstance(result, dict)]
+    if not parsed:
+        return results[0]
+    if len(parsed) < len(results):
+        print(f"⚠️ {len(results) - len(parsed)} of {len(results)} chunks could not be parsed and were skipped")
+    return merge_extractions(parsed)
+
+def chunk_budget(context):
+    """Tokens of document text that fit in one chunk alongside the request context."""
+    prefix, suffix = context
+    return max(EXTRACTION_CHUNK_TOKENS - count_tokens(prefix + suffix), MIN_CHUNK_TOKENS)
+
+async def _extract_chunk(text, max_retries):
+    """
+    Run the extraction prompt on one piece of text. Output that can't be
+    repaired, or a response slower than usual, is raced against another
+    request (see core.hedging), up to `max_retries` requests in all.
+    """
+
+    prompt = build_extraction_prompt(text)
+
+
+    # response = client.chat.completions.create(
+    #     model="mistralai/Mistral-7B-Instruct-v0.3",
+    #     messages=[{"role": "user", "content": prompt}],
+    #     max_tokens=2500,
+    #     temperature=0.77,
+    #     top_p=0.7,
+    #     top_k=50,
+    #     repetition_penalty=1,
+    #     stop=["</s>"],
+    # )
+
+    response = await hedged_completion(
+        "github",
+        messages=[
+            {
+                "role": "user",
+                "content": prompt,
+            }
+        ],
+        cache_check=is_valid_extraction,
+        name="extract",
+        max_extra=max_retries - 1,
+        **EXTRACTION_SETTINGS
+    )
+
+    raw_output = response.choices[0].message.content
+
+    try:
+        # Extract only the valid JSON part, repair it and enforce structure
+        clean_json = extract_json_from_text(raw_output)
+        return clean_json
 
-    print("Max retries reached. Returning raw output.")
-    return raw_output
+    except ValueError as e:
+        print(f"All {max_retries} attempts failed: {e}. Returning raw output.")
+        PARSE_FAILURES.inc(parser="extract_json_from_text")
+        return raw_output
 
 if __name__ == "__main__":
     requirement_text = "Specify the key requirements for the system."
     url = "https://res.cloudinary.com/depfpw7ym/image/upload/v1742658540/pre_sales_automation_dev/vmwarxl6olh62i7bvobr.pdf"  # Replace with a valid Cloudinary URL
     
-    processed_requirements = extract_requirements(requirement_text, url)
+    processed_requirements = asyncio.run(extract_requirements(requirement_text, url, None, None))
     
     print(processed_requirements)
\ No newline at end of file
@@ -0,0 +1,191 @@
+import os
+import re
+import time
+import zlib
+import uuid
+import hashlib
+from functools import lru_cache
+import orjson
+from core.metrics import Counter
+from core.sqlite_store import SQLiteLRUStore
+
+# Documents at least this similar (estimated Jaccard over word shingles) reuse a stored extraction
+SIMILARITY_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+# Stored documents expire after this long; least recently matched are evicted past the size cap
+INDEX_TTL_SECONDS = int(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", str(30 * 86400)))
+INDEX_MAX_BYTES = int(os.getenv("NEAR_DUPLICATE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: documents above ~0.7 similarity almost always share a bucket
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+NEAR_DUPLICATE_HITS = Counter(
+    "near_duplicate_hits_total", "Extractions based on a stored near-duplicate document."
+)
+
+_permutations = None
+
+
+def _get_permutations():
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+
+        # Fixed seed: signatures must stay comparable across processes and restarts
+        rng = np.random.RandomState(1)
+        _permutations = (
+            rng.randint(1, 1 << 31, size=NUM_PERMUTATIONS, dtype=np.uint64),
+            rng.randint(0, 1 << 31, size=NUM_PERMUTATIONS, dtype=np.uint64),
+        )
+    return _permutations
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Set of 32-bit hashes of the overlapping `size`-word windows of the normalized text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        windows = [" ".join(words)] if words else []
+    else:
+        windows = (" ".join(words[i:i + size]) for i in range(len(words) - size + 1))
+    return {zlib.crc32(window.encode()) for window in windows}
+
+
+def minhash_signature(text):
+    """MinHash signature (NUM_PERMUTATIONS uint32 values) of the text's shingle set."""
+    import numpy as np
+
+    hashes = np.fromiter(shingles(text), dtype=np.uint64)
+    if hashes.size == 0:
+        return np.full(NUM_PERMUTATIONS, _MAX_HASH, dtype=np.uint32)
+    a, b = _get_permutations()
+    # (a * h + b) mod p for every permutation/shingle pair; a, h < 2**32 keeps this inside uint64
+    permuted = (np.outer(a, hashes) + b[:, None]) % np.uint64(_MERSENNE_PRIME) & np.uint64(_MAX_HASH)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def estimate_similarity(signature, other):
+    """Estimated Jaccard similarity of two documents from their signatures."""
+    return float((signature == other).mean())
+
+
+def _band_keys(signature):
+    return [
+        hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(), digest_size=8).hexdigest()
+        for band in range(BANDS)
+    ]
+
+
+class NearDuplicateIndex(SQLiteLRUStore):
+    """
+    Persistent MinHash/LSH index of requirement documents and the parts of
+    their extractions (see `extract_sections`), so a near-duplicate or a
+    revision of a stored document can reuse the parts it did not change.
+
+    Lookups only compare against documents sharing at least one LSH band
+    bucket, so query cost does not grow with the number of stored documents.
+    Documents only match when their `context` (the non-document request
+    inputs, e.g. tech stack and platforms) is identical. Documents expire
+    after `ttl` seconds, and the least recently matched are evicted once the
+    stored parts exceed `max_bytes`.
+    """
+
+    table = "documents"
+    key_column = "id"
+    columns = ("context TEXT NOT NULL", "signature BLOB NOT NULL", "parts BLOB NOT NULL", "created_at REAL NOT NULL")
+
+    def __init__(self, path="documents.db", threshold=SIMILARITY_THRESHOLD, max_bytes=INDEX_MAX_BYTES, ttl=INDEX_TTL_SECONDS):
+        super().__init__(path, max_bytes)
+        self.threshold = threshold
+        self.ttl = ttl
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_created_at ON documents (created_at)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, document_id)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_document_id ON lsh_buckets (document_id)")
+
+    def add(self, text, context, parts):
+        """Store a document's extraction parts. Returns the new document id."""
+        signature = minhash_signature(text)
+        document_id = uuid.uuid4().hex
+        parts = orjson.dumps(parts)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT INTO documents (id, context, signature, parts, created_at, size, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (document_id, context, signature.tobytes(), parts, now, signature.nbytes + len(parts), now),
+                )
+                self._conn.executemany(
+                    "INSERT INTO lsh_buckets (band, bucket, document_id) VALUES (?, ?, ?)",
+                    [(band, key, document_id) for band, key in enumerate(_band_keys(signature))],
+                )
+                expired = self._conn.execute("SELECT id FROM documents WHERE created_at < ?", (now - self.ttl,)).fetchall()
+                self._delete([row[0] for row in expired])
+                self._evict()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return document_id
+
+    def _delete(self, keys):
+        super()._delete(keys)
+        self._conn.executemany("DELETE FROM lsh_buckets WHERE document_id = ?", [(key,) for key in keys])
+
+    def find(self, text, context):
+        """
+        Return the most similar stored document at or above the threshold, as a
+        dict with id, similarity and parts, or None.
+        """
+        import numpy as np
+
+        signature = minhash_signature(text)
+        conditions = " OR ".join(["(band = ? AND bucket = ?)"] * BANDS)
+        params = [value for pair in enumerate(_band_keys(signature)) for value in pair]
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT id, signature FROM documents
+                WHERE context = ? AND created_at >= ? AND id IN (SELECT document_id FROM lsh_buckets WHERE {conditions})
+                """,
+                [context, time.time() - self.ttl, *params],
+            ).fetchall()
+
+        best_id, best_similarity = None, 0.0
+        for document_id, stored in rows:
+            similarity = estimate_similarity(signature, np.frombuffer(stored, dtype=np.uint32))
+            if similarity >= self.threshold and similarity > best_similarity:
+                best_id, best_similarity = document_id, similarity
+        if best_id is None:
+            return None
+
+        row = self._get(best_id, ("parts",))
+        if row is None:
+            return None
+        return {"id": best_id, "similarity": best_similarity, "parts": orjson.loads(row[0])}
+
+
+def context_key(*inputs):
+    """Hash of the request inputs other than the document text."""
+    return hashlib.sha256(orjson.dumps(inputs)).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_index():
+    """Return the shared index, or None when NEAR_DUPLICATE_INDEX=off."""
+    if os.getenv("NEAR_DUPLICATE_INDEX", "on") == "off":
+        return None
+    return NearDuplicateIndex(os.getenv("NEAR_DUPLICATE_INDEX_PATH", "documents.db"))
@@ -0,0 +1,209 @@
+import json
+import orjson
+from core.llm_client import chat_completion_stream
+from .chunking import split_document
+from .main import (
+    EXTRACTION_SETTINGS,
+    build_extraction_prompt,
+    chunk_budget,
+    extract_json_from_text,
+    extract_requirements_llm,
+    is_valid_extraction,
+    prepare_document,
+    request_context,
+)
+
+# Top-level arrays whose items are emitted as soon as each one is complete
+STREAMED_KEYS = ("functional_requirements", "non_functional_requirements", "feature_breakdown")
+
+
+class IncrementalArrayParser:
+    """
+    Incrementally scans a JSON object as it is generated and returns every
+    complete item of the watched top-level arrays.
+
+    Text before the first "{" (e.g. a ```json fence) is ignored. Only the
+    item being built is kept in memory, so each fed chunk is scanned once.
+    """
+
+    def __init__(self, keys=STREAMED_KEYS):
+        self.keys = set(keys)
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_chars = []
+        self._last_key = None
+        self._array_key = None
+        self._item_chars = None
+        self._item_depth = 0
+
+    def feed(self, chunk):
+        """
+        Consume the next chunk of model output.
+
+        Returns:
+            list: (key, item) tuples for items completed within this chunk.
+        """
+        items = []
+        for char in chunk:
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+            if self._item_chars is not None:
+                self._item_chars.append(char)
+            if self._in_string:
+                self._consume_string_char(char, items)
+            else:
+                self._consume_structural_char(char, items)
+        return items
+
+    def _consume_string_char(self, char, items):
+        if self._escape:
+            self._escape = False
+        elif char == "\\":
+            self._escape = True
+        elif char == '"':
+            self._in_string = False
+            if self._depth == 1:
+                self._last_key = "".join(self._string_chars)
+            elif self._item_chars is not None and self._item_depth == 0:
+                self._finish_item(items)
+            return
+        if self._depth == 1:
+            self._string_chars.append(char)
+
+    def _consume_structural_char(self, char, items):
+        if char == '"':
+            self._in_string = True
+            self._string_chars = []
+            self._start_item_if_needed(char)
+            return
+
+        if char in "{[":
+            if self._depth == 1 and char == "[" and self._last_key in self.keys:
+                self._array_key = self._last_key
+            else:
+                self._start_item_if_needed(char)
+                if self._item_chars is not None:
+                    self._item_depth += 1
+            self._depth += 1
+        elif char in "}]":
+            self._depth -= 1
+            if self._item_chars is not None:
+                if self._item_depth == 0:
+                    # Closing bracket of the array ends a bare scalar item
+                    self._item_chars.pop()
+                    self._finish_item(items)
+                else:
+                    self._item_depth -= 1
+                    if self._item_depth == 0:
+                        self._finish_item(items)
+            if self._depth == 1:
+                self._array_key = None
+        elif char == ",":
+            if self._item_chars is not None and self._item_depth == 0:
+                self._item_chars.pop()
+                self._finish_item(items)
+        elif not char.isspace():
+            self._start_item_if_needed(char)
+
+    def _start_item_if_needed(self, char):
+        if self._array_key is not None and self._depth == 2 and self._item_chars is None:
+            self._item_chars = [char]
+            self._item_depth = 0
+
+    def _finish_item(self, items):
+        text = "".join(self._item_chars).strip()
+        self._item_chars = None
+        self._item_depth = 0
+        if not text:
+            return
+        try:
+            items.append((self._array_key, json.loads(text)))
+        except json.JSONDecodeError:
+            # A malformed item is left to the final full-document parse
+            pass
+
+
+def _well_formed(key, item):
+    """True when a streamed item has the shape the final result would give it."""
+    if key != "feature_breakdown":
+        return isinstance(item, str)
+    features = item.get("features", []) if isinstance(item, dict) else None
+    return isinstance(features, list) and all(isinstance(feature, dict) for feature in features)
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+async def stream_requirements(requirement_text: str, url: str, tech_stack, platforms):
+    """
+    Extract requirements while the model is still generating.
+
+    Yields Server-Sent Events: one event per completed requirement or
+    feature_breakdown module (named after its array), then a final "done"
+    event carrying the full result, or an "error" event. If the streamed
+    output can't be used and the extraction is redone, a "reset" event tells
+    the client to discard the items sent so far.
+    """
+    try:
+        async for event in _stream_events(requirement_text, url, tech_stack, platforms):
+            yield event
+    except Exception as e:
+        # The response has already started, so failures are reported in the stream
+        print(f"Streaming extraction failed: {e}")
+        yield _sse("error", {"error": str(e)})
+
+
+async def _stream_events(requirement_text, url, tech_stack, platforms):
+    document_text, page_offsets = await prepare_document(url)
+    if document_text is None:
+        yield _sse("error", {"error": "Failed to download the document"})
+        return
+    if not isinstance(document_text, str):
+        yield _sse("error", document_text)
+        return
+    context = request_context(requirement_text, tech_stack, platforms)
+
+    if len(split_document(document_text, chunk_budget(context), page_offsets)) > 1:
+        # Large documents are extracted in concurrent chunks; items are sent once merged
+        result = await extract_requirements_llm(document_text, page_offsets=page_offsets, context=context)
+        if isinstance(result, dict):
+            for key in STREAMED_KEYS:
+                for item in result.get(key, []):
+                    yield _sse(key, item)
+        yield _sse("done", result)
+        return
+
+    combined_text = context[0] + document_text + context[1]
+    parser = IncrementalArrayParser()
+    chunks = []
+    async for chunk in chat_completion_stream(
+        "github",
+        messages=[{"role": "user", "content": build_extraction_prompt(combined_text)}],
+        cache_check=is_valid_extraction,
+        **EXTRACTION_SETTINGS
+    ):
+        chunks.append(chunk)
+        for key, item in parser.feed(chunk):
+            if not _well_formed(key, item):
+                # Left to the final full-document parse, which rejects or repairs it
+                continue
+            if key == "feature_breakdown":
+                for feature in item.get("features", []):
+                    feature.setdefault("subfeatures", [])
+            yield _sse(key, item)
+
+    try:
+        result = extract_json_from_text("".join(chunks))
+    except ValueError as e:
+        print(f"Streamed output failed to parse: {e}. Retrying without streaming...")
+        # The new result need not contain the items already sent
+        yield _sse("reset", {})
+        result = await extract_requirements_llm(document_text, context=context)
+
+    yield _sse("done", result)
@@ -0,0 +1,50 @@
+import os
+import hashlib
+from functools import lru_cache
+import orjson
+from core.metrics import Counter
+from core.sqlite_store import SQLiteLRUStore
+from .extract_from_doc import EXTRACTOR_VERSION
+
+# Least recently used documents are evicted once stored text exceeds this size
+TEXT_CACHE_MAX_BYTES = int(os.getenv("EXTRACTED_TEXT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+TEXT_CACHE_HITS = Counter("extracted_text_cache_hits_total", "Documents whose text was reused instead of parsed.")
+TEXT_CACHE_MISSES = Counter("extracted_text_cache_misses_total", "Documents parsed because their text was not cached.")
+
+
+def text_cache_key(content, file_type):
+    """SHA-256 of the document bytes, tagged with the file type and extractor version."""
+    return f"{hashlib.sha256(content).hexdigest()}:{file_type}:v{EXTRACTOR_VERSION}"
+
+
+class ExtractedTextCache(SQLiteLRUStore):
+    """
+    Normalized text and page offsets of parsed documents, keyed by content
+    hash. Backed by a SQLite file shared by every worker on the host and kept
+    across restarts.
+    """
+
+    table = "texts"
+    columns = ("text TEXT NOT NULL", "offsets BLOB NOT NULL")
+
+    def __init__(self, path="extracted_text.db", max_bytes=TEXT_CACHE_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    def get(self, key):
+        """Return (text, offsets) for a document, or None."""
+        row = self._get(key, ("text", "offsets"))
+        if row is None:
+            return None
+        return row[0], orjson.loads(row[1])
+
+    def put(self, key, text, offsets):
+        self._put(key, len(text.encode()), text=text, offsets=orjson.dumps(offsets))
+
+
+@lru_cache(maxsize=None)
+def get_text_cache():
+    """Return the shared cache, or None when EXTRACTED_TEXT_CACHE=off."""
+    if os.getenv("EXTRACTED_TEXT_CACHE", "on") == "off":
+        return None
+    return ExtractedTextCache(os.getenv("EXTRACTED_TEXT_CACHE_PATH", "extracted_text.db"))
@@ -0,0 +1,153 @@
+import os
+import re
+from functools import lru_cache
+
+# Historical items returned per subfeature, and the most put into one prompt
+TOP_K = int(os.getenv("ESTIMATE_CONTEXT_TOP_K", "3"))
+MAX_REFERENCES = int(os.getenv("ESTIMATE_CONTEXT_MAX_ITEMS", "40"))
+# Rough prompt size of one reference line, used when sizing batches
+REFERENCE_TOKENS = 45
+
+# BM25 parameters: term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"a", "an", "and", "the", "of", "to", "for", "in", "on", "with", "by", "or", "at", "is"}
+
+
+def tokenize(text):
+    """Lowercase word tokens, stopwords dropped and plurals folded ("doctors" -> "doctor")."""
+    tokens = []
+    for word in _WORD.findall(text.lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def parse_estimate_context(text):
+    """
+    Read the `## Module > Feature > Subfeature` chunks of time_estimate_context.txt.
+    Returns a list of {"path", "metrics"} items, where metrics is the raw
+    "Development Days: 0.5, ..." text of the lines under the heading.
+    Repeated items are kept once.
+    """
+    items, seen = [], set()
+    for block in re.split(r"\n\s*\n", text):
+        lines = [line.strip() for line in block.strip().splitlines()]
+        if not lines or not lines[0].startswith("## "):
+            continue
+        path = lines[0][3:].strip()
+        # Some items carry a figure on an "Additional Info" line before their metrics
+        metrics = ", ".join(
+            line[len("Metrics:"):].strip() if line.startswith("Metrics:") else line for line in lines[1:] if line
+        )
+        if not path or not metrics or (path, metrics) in seen:
+            continue
+        seen.add((path, metrics))
+        items.append({"path": path, "metrics": metrics})
+    return items
+
+
+class EstimateIndex:
+    """BM25 index over historical estimate items, scored with NumPy."""
+
+    def __init__(self, items):
+        import numpy as np
+
+        self.items = items
+        documents = [tokenize(item["path"]) for item in items]
+        self.vocabulary = {}
+        for tokens in documents:
+            for token in tokens:
+                self.vocabulary.setdefault(token, len(self.vocabulary))
+
+        counts = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, tokens in enumerate(documents):
+            for token in tokens:
+                counts[row, self.vocabulary[token]] += 1
+        lengths = counts.sum(axis=1, keepdims=True)
+        average = max(float(lengths.mean()), 1.0) if len(documents) else 1.0
+        frequency = (counts > 0).sum(axis=0)
+        idf = np.log(1 + (len(documents) - frequency + 0.5) / (frequency + 0.5))
+        # Per-document term weights, so a query is scored with one matrix product
+        self._weights = idf * counts * (K1 + 1) / (counts + K1 * (1 - B + B * lengths / average))
+
+    def search_many(self, queries, k=TOP_K):
+        """
+        Top-`k` items for each query text, best first.
+        Returns one list of (score, item index) per query; items that share no term are left out.
+        """
+        import numpy as np
+
+        if not queries or not self.items:
+            return [[] for _ in queries]
+        matrix = np.zeros((len(queries), len(self.vocabulary)), dtype=np.float32)
+        for row, query in enumerate(queries):
+            for token in tokenize(query):
+                column = self.vocabulary.get(token)
+                if column is not None:
+                    matrix[row, column] += 1
+        scores = matrix @ self._weights.T
+        k = min(k, len(self.items))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = sorted(((float(scores[row, index]), int(index)) for index in candidates), reverse=True)
+            results.append([(score, index) for score, index in ranked if score > 0])
+        return results
+
+    def references(self, modules, k=TOP_K, limit=MAX_REFERENCES):
+        """
+        Historical items similar to the subfeatures of `modules`, as prompt
+        lines. Every subfeature's best match is taken before any second
+        match, up to `limit` distinct items.
+        """
+        queries = []
+        for module in modules:
+            if not isinstance(module, dict):
+                continue
+            module_name = module.get("module") or module.get("component")
+            features = [feature for feature in module.get("features") or [] if isinstance(feature, dict)]
+            if not features:
+                queries.append(str(module_name or ""))
+            for feature in features:
+                for subfeature in feature.get("subfeatures") or [feature]:
+                    subfeature_name = subfeature.get("name") if isinstance(subfeature, dict) else subfeature
+                    names = (module_name, feature.get("name"), subfeature_name)
+                    queries.append(" ".join(str(name) for name in names if name))
+        ranked = self.search_many(queries, k)
+        chosen, seen = [], set()
+        for rank in range(k):
+            for matches in ranked:
+                if len(chosen) >= limit:
+                    break
+                if rank < len(matches) and matches[rank][1] not in seen:
+                    seen.add(matches[rank][1])
+                    chosen.append(matches[rank][1])
+        return [f"- {self.items[index]['path']}: {self.items[index]['metrics']}" for index in chosen]
+
+
+# The historical estimates ship at the repository root, next to app.py
+DEFAULT_CONTEXT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "time_estimate_context.txt")
+
+
+@lru_cache(maxsize=None)
+def get_estimate_index():
+    """
+    Return the index over time_estimate_context.txt (ESTIMATE_CONTEXT_PATH),
+    building it on first use. None when ESTIMATE_CONTEXT=off or the file is missing.
+    """
+    if os.getenv("ESTIMATE_CONTEXT", "on") == "off":
+        return None
+    try:
+        with open(os.getenv("ESTIMATE_CONTEXT_PATH", DEFAULT_CONTEXT_PATH), "r", encoding="utf-8") as file:
+            items = parse_estimate_context(file.read())
+    except FileNotFoundError:
+        print("\n⚠️ time_estimate_context.txt file not found. Proceeding without historical context.")
+        return None
+    print(f"Indexed {len(items)} historical estimates")
+    return EstimateIndex(items)
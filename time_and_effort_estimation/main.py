@@ -1,19 +1,22 @@
+import io
 import json
-import os
-import pandas as pd
-from dotenv import load_dotenv
-from together import Together
-from langchain.output_parsers import PydanticOutputParser
+import asyncio
+from core.llm_client import hedged_completion
+from core.json_repair import JSONRepairError, is_json, parse_json
+from core.metrics import PARSE_FAILURES
+from core.prompts import (
+    OUTPUT_HEADROOM,
+    compact_json,
+    count_tokens,
+    model_limits,
+    output_budget,
+    split_to_fit,
+)
+from core.tracing import span
+from .estimate_index import MAX_REFERENCES, REFERENCE_TOKENS, get_estimate_index
 from pydantic.v1 import BaseModel, Field, validator
 from typing import List, Optional
 
-# Load API key
-load_dotenv()
-api_key = os.getenv("TOGETHER_API_KEY")
-
-# Initialize Together client
-client = Together(api_key=api_key)
-
 # Updated pricing model (hourly rates in INR)
 pricing_model = {
     "Frontend": 15,
@@ -54,107 +57,104 @@ class EffortEstimation(BaseModel):
             "description": "Structured effort estimation for software development"
         }
 
-def estimate_effort(feature_breakdown):
-    """Estimate frontend and backend efforts using Mistral LLM with Langchain parser."""
-    
-    # Initialize the Pydantic parser
-    parser = PydanticOutputParser(pydantic_object=EffortEstimation)
-    # Load RAG context from file
-    try:
-        with open("time_estimate_context.txt", "r", encoding="utf-8") as file:
-            time_estimate_context = file.read()
-    except FileNotFoundError:
-        # Fallback if file doesn't exist
-        time_estimate_context = "No historical context available."
-        print("\n⚠️ time_estimate_context.txt file not found. Proceeding without historical context.")
-    
-    try:
-        with open("cost_estimate_context.txt", "r", encoding="utf-8") as file:
-            cost_estimate_context = file.read()
-    except FileNotFoundError:
-        # Fallback if file doesn't exist
-        cost_estimate_context = "No historical context available."
-        print("\n⚠️ cost_estimate_context.txt file not found. Proceeding without historical context.")
-    
-    # Modified format instructions for Pydantic v1
-    format_instructions = """
-    The output should be formatted as a JSON instance that conforms to the JSON schema below.
-
-    {
-        "properties": {
-            "effort_estimation": {
-                "title": "Effort Estimation",
-                "description": "List of modules with effort estimations",
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "module": {
-                            "title": "Module",
-                            "description": "Name of the module",
-                            "type": "string"
-                        },
-                        "features": {
-                            "title": "Features",
-                            "description": "List of features in this module",
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "name": {
-                                        "title": "Name",
-                                        "description": "Name of the feature",
-                                        "type": "string"
-                                    },
-                                    "subfeatures": {
-                                        "title": "Subfeatures",
-                                        "description": "List of subfeatures with effort estimations",
-                                        "type": "array",
-                                        "items": {
-                                            "type": "object",
-                                            "properties": {
-                                                "name": {
-                                                    "title": "Name",
-                                                    "description": "Name of the subfeature",
-                                                    "type": "string"
-                                                },
-                                                "frontend_days": {
-                                                    "title": "Frontend Days",
-                                                    "description": "Number of days required for frontend development",
-                                                    "type": "number"
-                                                },
-                                                "backend_days": {
-                                                    "title": "Backend Days",
-                                                    "description": "Number of days required for backend development",
-                                                    "type": "number"
-                                                }
-                                            },
-                                            "required": ["name", "frontend_days", "backend_days"]
-                                        }
-                                    }
-                                },
-                                "required": ["name", "subfeatures"]
-                            }
-                        },
-                        "frontend_days": {
-                            "title": "Frontend Days",
-                            "description": "Total frontend development days for the module",
-                            "type": "number"
-                        },
-                        "backend_days": {
-                            "title": "Backend Days",
-                            "description": "Total backend development days for the module",
-                            "type": "number"
-                        }
-                    },
-                    "required": ["module", "features"]
-                }
+ESTIMATE_MODEL = "mistralai/Mistral-7B-Instruct-v0.3"
+
+# The shape EffortEstimation parses, spelled out compactly instead of as a full JSON schema
+EFFORT_FORMAT = (
+    'Return a JSON object of this shape: {"effort_estimation":[{"module":"Module name","features":'
+    '[{"name":"Feature name","subfeatures":[{"name":"Subfeature name","frontend_days":1.5,"backend_days":2}]}]}]}. '
+    '"frontend_days" and "backend_days" are numbers of days.'
+)
+
+def _feature_modules(feature_breakdown):
+    """
+    Normalize the estimate input (a Requirements model or dict, a module list,
+    or a JSON string of either) and return (modules, data).
+    """
+    if isinstance(feature_breakdown, str):
+        try:
+            data = json.loads(feature_breakdown)
+        except json.JSONDecodeError:
+            return [], feature_breakdown
+    else:
+        data = json.loads(compact_json(feature_breakdown))
+    if isinstance(data, dict):
+        modules = data.get("featureBreakdown") or data.get("feature_breakdown") or []
+    else:
+        modules = data if isinstance(data, list) else []
+    return modules, data
+
+def _expected_effort_tokens(modules):
+    """Approximate size of the estimate for these modules: one entry per subfeature."""
+    skeleton = {
+        "effort_estimation": [
+            {
+                "module": module.get("module", ""),
+                "features": [
+                    {
+                        "name": feature.get("name", ""),
+                        "subfeatures": [
+                            {"name": subfeature.get("name", ""), "frontend_days": 0.0, "backend_days": 0.0}
+                            for subfeature in (feature.get("subfeatures") or [feature])
+                        ],
+                    }
+                    for feature in module.get("features", [])
+                ],
             }
-        },
-        "required": ["effort_estimation"]
+            for module in modules
+        ]
     }
+    # Models pretty-print their JSON, which adds about half again to the compact form
+    return int(1.5 * count_tokens(compact_json(skeleton)))
+
+def _split_modules(modules):
     """
-    
+    Batch modules so each request's prompt fits the context window and its
+    estimate fits the output limit. Small breakdowns stay in one batch.
+    """
+    limits = model_limits(ESTIMATE_MODEL)
+    max_output = int(limits["max_output"] / OUTPUT_HEADROOM)
+    max_input = (
+        limits["context"] - limits["max_output"] - count_tokens(EFFORT_FORMAT) - 500
+        - MAX_REFERENCES * REFERENCE_TOKENS
+    )
+    return [
+        batch
+        for input_batch in split_to_fit(modules, max_input)
+        for batch in split_to_fit(input_batch, max_output, measure=lambda module: _expected_effort_tokens([module]))
+    ]
+
+async def estimate_effort(feature_breakdown):
+    """
+    Estimate frontend and backend efforts using Mistral LLM, validated against EffortEstimation.
+    Large feature breakdowns are split by module into concurrent requests.
+    Each request includes the historical estimates most similar to its subfeatures.
+    """
+    modules, data = _feature_modules(feature_breakdown)
+    if not modules:
+        # Unrecognized shape, estimate from the input as given
+        return await _estimate_batch(data, None)
+
+    batches = _split_modules(modules)
+    if len(batches) > 1:
+        print(f"Splitting effort estimation of {len(modules)} modules into {len(batches)} requests")
+    results = await asyncio.gather(
+        *(_estimate_batch(batch, _expected_effort_tokens(batch)) for batch in batches)
+    )
+    if any(result is None for result in results):
+        return None
+    return {"effort_estimation": [module for result in results for module in result["effort_estimation"]]}
+
+async def _estimate_batch(features, expected_tokens):
+    """Estimate one batch of modules. Returns the parsed estimate dict or None."""
+    index = get_estimate_index()
+    references = index.references(features) if index is not None and isinstance(features, list) else []
+    history = ""
+    if references:
+        history = (
+            "Historical estimates for similar work (Module > Feature > Subfeature: metrics), "
+            "use them to calibrate your numbers:\n" + "\n".join(references)
+        )
     prompt = f"""
         Based on the given software features and subfeatures, estimate effort (in days) for each role:
         
@@ -166,152 +166,86 @@ def estimate_effort(feature_breakdown):
         - Each feature has a name and list of subfeatures
         - If a feature has direct effort values, still create a single subfeature with the same name
         
-        {format_instructions}
+        {EFFORT_FORMAT}
         
         # IMPORTANT: Every feature MUST have a subfeatures array, even if it only contains one item.
         # Do NOT omit the subfeatures field for any feature.
 
+        {history}
+
         Features & Subfeatures:
-        {feature_breakdown}
+        {compact_json(features)}
 
         Provide the output in valid JSON format only.
     """
 
-    response = client.chat.completions.create(
-        model="mistralai/Mistral-7B-Instruct-v0.3",
+    if expected_tokens is None:
+        expected_tokens = count_tokens(prompt)
+    response = await hedged_completion(
+        "together",
+        name="estimate",
+        model=ESTIMATE_MODEL,
         messages=[{"role": "user", "content": prompt}],
-        max_tokens=3000,
+        # Scales with the number of subfeatures so big breakdowns are not truncated
+        max_tokens=output_budget(ESTIMATE_MODEL, prompt, expected_tokens, minimum=3000),
         temperature=0.7,
         top_p=0.9,
         stop=["</s>"],
+        cache_check=lambda text: is_json(text, EffortEstimation),
     )
 
     raw_output = response.choices[0].message.content.strip()
 
     try:
-        # Parse using the Langchain parser
-        parsed_output = parser.parse(raw_output)
-        return parsed_output.dict()
-    except Exception as e:
-        print(f"\n❌ Error parsing with Langchain: {e}")
-        # Fallback to manual parsing if Langchain parser fails
-        try:
-            # Try to extract the JSON part from the response
-            json_start = raw_output.find('{')
-            json_end = raw_output.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = raw_output[json_start:json_end]
-                json_output = json.loads(json_str)
-                
-                # Basic validation of the structure
-                if "effort_estimation" not in json_output:
-                    raise ValueError("Missing 'effort_estimation' key in the response")
-                
-                return json_output
-            else:
-                raise ValueError("Could not find valid JSON in the response")
-        except Exception as e2:
-            print(f"\n❌ Fallback parsing also failed: {e2}")
-            return None
-
-def parse_llm_response(response_text):
-    """Original parse function kept for compatibility."""
-    try:
-        parsed_data = json.loads(response_text)
-
-        if not isinstance(parsed_data, dict) or "effort_estimation" not in parsed_data:
-            raise ValueError("Invalid JSON format received from the model.")
-
-        for module in parsed_data["effort_estimation"]:
-            if "module" not in module or "features" not in module:
-                raise ValueError("Missing required keys in module structure.")
-
-            for feature in module["features"]:
-                if "name" not in feature or "subfeatures" not in feature:
-                    raise ValueError("Missing required keys in feature structure.")
-
-                for subfeature in feature["subfeatures"]:
-                    required_keys = {"name", "frontend_days", "backend_days"}
-                    if not required_keys.issubset(subfeature):
-                        raise ValueError(f"Subfeature {subfeature.get('name', 'unknown')} is missing required keys.")
-
-        return parsed_data
-
-    except (json.JSONDecodeError, ValueError) as e:
-        print(f"\n❌ Error parsing JSON: {e}")
-        return None  # Return None to handle it gracefully
-    
-def manual_parse_effort(raw_output):
-    """Last resort manual parsing of effort data with structural fixes."""
-    try:
-        # Preprocess to fix common issues
-        json_str = preprocess_llm_response(raw_output)
-        data = json.loads(json_str)
-        
-        # Check and fix module structure
-        if "effort_estimation" in data:
-            for i, module in enumerate(data["effort_estimation"]):
-                # Ensure features exists
-                if "features" not in module:
-                    module["features"] = []
-                
-                # Add missing subfeatures
-                for j, feature in enumerate(module["features"]):
-                    if "subfeatures" not in feature:
-                        if "frontend_days" in feature:
-                            # Create subfeature from feature itself
-                            feature["subfeatures"] = [{
-                                "name": feature.get("name", "Unknown"),
-                                "frontend_days": feature.get("frontend_days", 0),
-                                "backend_days": feature.get("backend_days", 0)
-                            }]
-        
-        return data
-    except Exception as e:
-        print(f"Manual parsing failed: {e}")
+        return _normalize_effort(parse_json(raw_output, EffortEstimation))
+    except JSONRepairError as e:
+        print(f"\n❌ Error parsing effort estimation: {e}")
+        PARSE_FAILURES.inc(parser="estimate_effort")
         return None
-    
-def preprocess_llm_response(raw_output):
-    """Clean and fix common JSON formatting issues from LLM responses."""
-    # Try to extract just the JSON part
-    json_start = raw_output.find('{')
-    json_end = raw_output.rfind('}') + 1
-    
-    if json_start >= 0 and json_end > json_start:
-        json_str = raw_output[json_start:json_end]
-        
-        # Fix for features without subfeatures
-        import re
-        pattern = r'"features":\s*\[\s*{\s*"name":\s*"([^"]+)",\s*"frontend_days":'
-        replacement = r'"features": [{"name": "\1", "subfeatures": [{"name": "\1", "frontend_days":'
-        json_str = re.sub(pattern, replacement, json_str)
-        
-        # Fix for unclosed arrays or missing commas
-        json_str = json_str.replace('"}]"}', '"}]}')
-        json_str = json_str.replace('"Testing"}', '"Testing"}]')
-        
-        return json_str
-    return raw_output
 
-def generate_effort_excel(feature_breakdown, output_excel="effort_estimation.xlsx"):
-    """Generate effort and cost estimation Excel file with two sheets."""
+def _normalize_effort(effort_data):
+    """Give features estimated directly (without subfeatures) a single subfeature of the same name."""
+    for module in effort_data["effort_estimation"]:
+        for feature in module["features"]:
+            feature["subfeatures"] = feature["subfeatures"] or []
+            if not feature["subfeatures"] and feature["frontend_days"] is not None:
+                feature["subfeatures"] = [{
+                    "name": feature["name"],
+                    "frontend_days": feature["frontend_days"],
+                    "backend_days": feature["backend_days"] or 0,
+                }]
+    return effort_data
+
+async def generate_effort_excel(feature_breakdown, output_excel="effort_estimation.xlsx"):
+    """
+    Generate effort and cost estimation Excel file with two sheets.
+    `output_excel` may be a file path or a writable binary buffer such as BytesIO.
+    """
     
-    effort_data = estimate_effort(feature_breakdown)
+    with span("estimate.llm"):
+        effort_data = await estimate_effort(feature_breakdown)
 
-    # Handle parsing errors
+    # Malformed output has already been repaired locally where possible
     if not effort_data:
-        print("\n⚠️ No valid effort estimation data available. Falling back to original parser.")
-        raw_output = client.chat.completions.create(
-            model="mistralai/Mistral-7B-Instruct-v0.3",
-            messages=[{"role": "user", "content": f"Parse this JSON and return only valid JSON: {feature_breakdown}"}],
-            max_tokens=3000,
-            temperature=0.2,
-        ).choices[0].message.content.strip()
-        
-        effort_data = parse_llm_response(raw_output)
-        if not effort_data:
-            print("\n❌ All parsing attempts failed. Cannot generate Excel file.")
-            return
+        print("\n❌ No valid effort estimation data available. Cannot generate Excel file.")
+        return
+
+    # pandas/xlsxwriter work is blocking, keep it off the event loop
+    with span("estimate.excel"):
+        await asyncio.to_thread(write_effort_excel, effort_data, output_excel)
+
+async def build_effort_excel(feature_breakdown):
+    """
+    Generate the effort estimation workbook in memory and return its bytes,
+    or None if no estimate could be parsed.
+    """
+    output_excel = io.BytesIO()
+    await generate_effort_excel(feature_breakdown, output_excel)
+    return output_excel.getvalue() or None
+
+def write_effort_excel(effort_data, output_excel="effort_estimation.xlsx"):
+    """Write parsed effort estimation data to an Excel file with two sheets."""
+    import pandas as pd
     
     effort_rows = []
     cost_rows = []
@@ -449,11 +383,12 @@ def generate_effort_excel(feature_breakdown, output_excel="effort_estimation.xls
             column_width = max(cost_summary_df[col].astype(str).map(len).max(), len(col))
             worksheet.set_column(i, i, column_width + 2)
 
-    print(f"\n✅ Cost estimation Excel file generated with new Cost Summary sheet: {output_excel}")
+    target = output_excel if isinstance(output_excel, str) else "in-memory workbook"
+    print(f"\n✅ Cost estimation Excel file generated with new Cost Summary sheet: {target}")
 
 if __name__ == "__main__":
     # Example JSON feature breakdown (same as your original example)
     feature_breakdown = {}
 
     # Generate Excel file
-    generate_effort_excel(json.dumps(feature_breakdown))
\ No newline at end of file
+    asyncio.run(generate_effort_excel(json.dumps(feature_breakdown)))
\ No newline at end of file
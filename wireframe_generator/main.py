@@ -1,27 +1,20 @@
 import os
 import re
-import json
 import time
-from together import Together
+import asyncio
 from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from core.llm_client import chat_completion
+from core.prompts import compact_json
+from core.tracing import span
+
+# selenium and webdriver_manager are imported inside the browser steps so
+# importing this module (and the app) does not pay for them
 
 # Load API key from .env file
 load_dotenv()
-api_key = os.getenv("TOGETHER_API_KEY")
 email = os.getenv("EMAIL")
 password = os.getenv("PASSWORD")
 
-# Initialize Together client
-client = Together(api_key=api_key)
-
 def generate_prompt(feature_breakdown):
     """Generates a natural language description of the feature breakdown."""
     prompt = (
@@ -29,14 +22,15 @@ def generate_prompt(feature_breakdown):
         "focusing **only on Website features**. "
         "Completely ignore any content related to Mobile or Apps, and exclude all mentions of mobile-specific tabs or features. "
         "The description must be strictly under 1000 characters, and avoid repeating similar sections:\n\n"
-        f"{json.dumps(feature_breakdown, indent=2, default=str)}"
+        f"{compact_json(feature_breakdown)}"
     )
 
     return prompt
 
-def get_llm_response(prompt):
+async def get_llm_response(prompt):
     """Fetches the response from an LLM (like OpenAI GPT) based on the feature breakdown."""
-    response = client.chat.completions.create(
+    response = await chat_completion(
+        "together",
         model="mistralai/Mistral-7B-Instruct-v0.3",
         messages=[{"role": "user", "content": prompt}],
         max_tokens=2500,
@@ -49,90 +43,139 @@ def get_llm_response(prompt):
 
     return response.choices[0].message.content
 
-def selenium_pipeline(feature_breakdown, isMobileApp):
+async def selenium_pipeline(feature_breakdown, isMobileApp):
     """Executes the Selenium automation pipeline."""
 
-    
+    # The browser login and the LLM prompt generation are independent, so the
+    # blocking Selenium steps run in worker threads while the LLM call is awaited.
+    llm_prompt = generate_prompt(feature_breakdown)
+    driver_task = asyncio.ensure_future(asyncio.to_thread(open_design_editor, isMobileApp))
+    try:
+        llm_response = await get_llm_response(llm_prompt)
+        # Shielded: cancelling the await would not stop the thread, only lose the driver it returns
+        driver = await asyncio.shield(driver_task)
+        return await asyncio.to_thread(generate_wireframes, driver, llm_response)
+    finally:
+        # Close the browser however the run ends, including on cancellation
+        await asyncio.shield(_quit_driver(driver_task))
 
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service)
-    
-    # Step 1: Navigate to login page
-    driver.get("https://www.usegalileo.ai/login")
-    time.sleep(5)
+async def _quit_driver(driver_task):
+    """Quit the browser opened by `driver_task` once it has started."""
+    try:
+        driver = await driver_task
+    except Exception:
+        # open_design_editor closes the browser itself when it fails
+        return
+    await asyncio.to_thread(driver.quit)
+
+def open_design_editor(isMobileApp):
+    """Logs in to usegalileo.ai and opens a new design. Returns the Selenium driver."""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    with span("wireframe.start_browser"):
+        service = Service(ChromeDriverManager().install())
+        driver = webdriver.Chrome(service=service)
+
+    try:
+        _log_in_and_open_design(driver)
+    except BaseException:
+        driver.quit()
+        raise
+    return driver
+
+def _log_in_and_open_design(driver):
+    """Log in with EMAIL/PASSWORD and start a new web design."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    with span("wireframe.login"):
+        # Step 1: Navigate to login page
+        driver.get("https://www.usegalileo.ai/login")
+        time.sleep(5)
     
-    # Step 2 & 3: Enter credentials and log in
-    email_box = driver.find_element(By.TAG_NAME, "input")
-    email_box.click()
-    email_box.send_keys(email)
-    email_box.send_keys(Keys.ENTER)
-    time.sleep(2)
+        # Step 2 & 3: Enter credentials and log in
+        email_box = driver.find_element(By.TAG_NAME, "input")
+        email_box.click()
+        email_box.send_keys(email)
+        email_box.send_keys(Keys.ENTER)
+        time.sleep(2)
     
-    password_box = WebDriverWait(driver, 10).until(
-        EC.element_to_be_clickable((By.XPATH, "//input[@type='password']"))
-    )
-    password_box.send_keys(password)
-    password_box.send_keys(Keys.ENTER)
-    time.sleep(5)
+        password_box = WebDriverWait(driver, 10).until(
+            EC.element_to_be_clickable((By.XPATH, "//input[@type='password']"))
+        )
+        password_box.send_keys(password)
+        password_box.send_keys(Keys.ENTER)
+        time.sleep(5)
     
-    # Step 4: Navigate to create page and interact with UI
-    driver.get("https://www.usegalileo.ai/create")
-    time.sleep(5)
+    with span("wireframe.open_editor"):
+        # Step 4: Navigate to create page and interact with UI
+        driver.get("https://www.usegalileo.ai/create")
+        time.sleep(5)
 
-    driver.find_element(By.ID, "start-new-design").click()
-    time.sleep(2)
-    
-    # # Step 5: Select Web option and input prompt
-    driver.find_element(By.XPATH, "//html/body/div[1]/main/div[2]/div/div[2]/div/div[2]/div/div/footer/div/div/div[2]/div[1]/div/button[2]").click()
-    time.sleep(2)
+        driver.find_element(By.ID, "start-new-design").click()
+        time.sleep(2)
     
-    # # Generate LLM-based prompt
-    llm_prompt = generate_prompt(feature_breakdown)
-    llm_response = get_llm_response(llm_prompt)
+        # # Step 5: Select Web option and input prompt
+        driver.find_element(By.XPATH, "//html/body/div[1]/main/div[2]/div/div[2]/div/div[2]/div/div/footer/div/div/div[2]/div[1]/div/button[2]").click()
+        time.sleep(2)
 
-    # Wait for the textbox to appear
-    textbox = WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.XPATH, "//div[@role='textbox']"))
-    )
+def generate_wireframes(driver, llm_response):
+    """Submits the LLM description to the open design and returns the generated image links."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    with span("wireframe.submit_prompt"):
+        # Wait for the textbox to appear
+        textbox = WebDriverWait(driver, 10).until(
+            EC.presence_of_element_located((By.XPATH, "//div[@role='textbox']"))
+        )
 
-    # Click the textbox to activate it
-    textbox.click()
-    time.sleep(10)
+        # Click the textbox to activate it
+        textbox.click()
+        time.sleep(10)
 
-    # print(llm_response)
+        # print(llm_response)
     
-    driver.execute_script("arguments[0].innerText = arguments[1];", textbox, llm_response)
-    textbox.send_keys(Keys.SPACE)
-    textbox.send_keys(Keys.ENTER)
+        driver.execute_script("arguments[0].innerText = arguments[1];", textbox, llm_response)
+        textbox.send_keys(Keys.SPACE)
+        textbox.send_keys(Keys.ENTER)
     
-    # # Step 6: Wait for UI to generate
-    time.sleep(60)
+    with span("wireframe.wait_for_design"):
+        # # Step 6: Wait for UI to generate
+        time.sleep(60)
 
-    textbox = driver.find_element(By.CSS_SELECTOR, "div[role='textbox']")
-    textbox.click()
-    textbox.send_keys("Yes, generate it")
-    textbox.send_keys(Keys.ENTER)
-    # driver.execute_script("arguments[0].innerText = arguments[1];", textbox, "yes generate it")
-    # textbox.send_keys(Keys.SPACE)
-    # textbox.send_keys(Keys.ENTER)
+    with span("wireframe.confirm_generation"):
+        textbox = driver.find_element(By.CSS_SELECTOR, "div[role='textbox']")
+        textbox.click()
+        textbox.send_keys("Yes, generate it")
+        textbox.send_keys(Keys.ENTER)
+        # driver.execute_script("arguments[0].innerText = arguments[1];", textbox, "yes generate it")
+        # textbox.send_keys(Keys.SPACE)
+        # textbox.send_keys(Keys.ENTER)
 
-    time.sleep(60)
+        time.sleep(60)
     
-    # Step 7: Extract image links
-    image_elements = driver.find_elements(By.XPATH, "//img[contains(@src, 'https://cdn.usegalileo.ai/') or contains(@srcset, 'https://cdn.usegalileo.ai/')]")
+    with span("wireframe.collect_images"):
+        # Step 7: Extract image links
+        image_elements = driver.find_elements(By.XPATH, "//img[contains(@src, 'https://cdn.usegalileo.ai/') or contains(@srcset, 'https://cdn.usegalileo.ai/')]")
 
-    img_links = []
+        img_links = []
 
-    for img in image_elements:
-        srcset = img.get_attribute("srcset")
-        if srcset:
-            # Extract URLs from srcset that contain 'cdn.usegalileo.ai'
-            urls = [entry.split(" ")[0] for entry in srcset.split(",") if "cdn.usegalileo.ai" in entry]
-            img_links.extend(urls)
+        for img in image_elements:
+            srcset = img.get_attribute("srcset")
+            if srcset:
+                # Extract URLs from srcset that contain 'cdn.usegalileo.ai'
+                urls = [entry.split(" ")[0] for entry in srcset.split(",") if "cdn.usegalileo.ai" in entry]
+                img_links.extend(urls)
 
-    # Print all extracted image links
-    print(img_links)
-    driver.quit()
+        # Print all extracted image links
+        print(img_links)
 
     return img_links
 
@@ -292,5 +335,5 @@ if __name__ == "__main__":
         ]
     }
     
-    image_links = selenium_pipeline(feature_breakdown)
+    image_links = asyncio.run(selenium_pipeline(feature_breakdown, False))
     print(image_links)
\ No newline at end of file